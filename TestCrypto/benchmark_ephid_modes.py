@@ -0,0 +1,48 @@
+#! /bin/python3
+
+"""
+This module contains the script comparing the EphID derivation modes, producing the EphIDs of a whole day
+and the EphID of a single slot with each of them.
+"""
+
+import argparse
+from secrets import token_bytes
+from timeit import timeit
+
+from cipher import Encryptor, batch_generate_ephids
+from definitions import IV_SIZE
+from parameters import N, SK_SIZE, EPHID_MODE_CBC, EPHID_MODE_PRF
+
+
+# Names of the compared EphID derivation modes
+MODE_NAMES = {EPHID_MODE_CBC: 'CBC', EPHID_MODE_PRF: 'PRF'}
+
+
+def benchmark(mode, sks, iv, repeat):
+    """Measures how long producing the EphIDs takes in an EphID derivation mode.
+    :param mode: the EphID derivation mode
+    :param sks: a list of the bytes sequences representing the SKs to produce the EphIDs of
+    :param iv: the bytes sequence representing the IV
+    :param repeat: the number of times each measure is repeated
+    :returns a dictionary mapping the name of each measure to the average number of microseconds it takes"""
+    encryptor = Encryptor(sks[0], mode)
+    return {
+        'full day': timeit(lambda: encryptor.encrypt(iv), number=repeat) / repeat * 1e6,
+        'first slot': timeit(lambda: encryptor.encrypt_slot(iv, 0), number=repeat) / repeat * 1e6,
+        'last slot': timeit(lambda: encryptor.encrypt_slot(iv, N - 1), number=repeat) / repeat * 1e6,
+        f'full day of {len(sks)} SKs': timeit(lambda: batch_generate_ephids(sks, iv, mode), number=1) * 1e6,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the EphID derivation modes.')
+    parser.add_argument('--repeat', type=int, default=10000, help='number of times each measure is repeated')
+    parser.add_argument('--sks', type=int, default=10000, help='number of SKs produced at once')
+    args = parser.parse_args()
+
+    sks = [token_bytes(SK_SIZE) for _ in range(args.sks)]
+    iv = token_bytes(IV_SIZE)
+
+    for mode, name in MODE_NAMES.items():
+        for measure, microseconds in benchmark(mode, sks, iv, args.repeat).items():
+            print(f'{name:<4} {measure:<24} {microseconds:12.1f} us')
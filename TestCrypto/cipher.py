@@ -3,11 +3,13 @@ This module contains the methods and classes to produce the encryption of messag
 """
 
 import os
+from itertools import repeat
 
+import numpy as np
 from Crypto.Cipher import AES
 from secrets import token_bytes
 
-from parameters import N, ROOT_DIR
+from parameters import N, ROOT_DIR, EPHID_MODE, EPHID_MODES, EPHID_MODE_CBC
 
 
 # Size in bytes of each block supported by the cipher
@@ -34,6 +36,33 @@ def _read_broadcast_key():
     return broadcast_key
 
 
+# The common Broadcast Key, read only once per process and shared by all the cipher objects (see get_broadcast_key)
+_broadcast_key = None
+
+
+def get_broadcast_key():
+    """Returns the common Broadcast Key, reading it from the proper file only the first time it is requested
+    in the process.
+    :raises FileNotFoundError if the file doesn't exist
+    :raises ValueError if the the length of the content of the file does not match BROADCAST_KEY_SIZE
+    :return broadcast_key: the bytes sequence representing the common Broadcast Key"""
+    global _broadcast_key
+    if _broadcast_key is None:
+        _broadcast_key = _read_broadcast_key()
+    return _broadcast_key
+
+
+def reload_broadcast_key():
+    """Reads the common Broadcast Key from the proper file again, e.g. because it has been rotated.
+    The Encryptor and Decryptor objects created afterwards use the new key, the existing ones keep the old one.
+    :raises FileNotFoundError if the file doesn't exist
+    :raises ValueError if the the length of the content of the file does not match BROADCAST_KEY_SIZE
+    :return broadcast_key: the bytes sequence representing the new common Broadcast Key"""
+    global _broadcast_key
+    _broadcast_key = _read_broadcast_key()
+    return _broadcast_key
+
+
 def _pad(msg):
     """Pads a message with empty bytes in order to fit it as a proper input for the cipher.
     For example, if the message is 41 bytes long and the block size is 16 bytes, it will be padded with 7 bytes"""
@@ -42,18 +71,88 @@ def _pad(msg):
     return msg
 
 
+def _xor_iv(msg, iv):
+    """Returns a message with the IV XORed into each of its blocks.
+    :param msg: the bytes sequence representing the message, whose length is a multiple of BLOCK_SIZE
+    :param iv: the bytes sequence representing the IV, of BLOCK_SIZE bytes"""
+    ivs = iv * (len(msg) // BLOCK_SIZE)
+    return (int.from_bytes(msg, 'big') ^ int.from_bytes(ivs, 'big')).to_bytes(len(msg), 'big')
+
+
+def _check_mode(mode):
+    """:raises ValueError if :param mode is not one of the supported EphID derivation modes"""
+    if mode not in EPHID_MODES:
+        raise ValueError(f'EphID derivation mode {mode} not supported')
+
+
+def _new_cipher(key, iv, mode):
+    """Creates the AES cipher producing the EphIDs in the given mode.
+    In EPHID_MODE_CBC, the cipher works in CBC mode with the given IV;
+    in EPHID_MODE_PRF, the cipher works in ECB mode, and the IV has to be XORed into each block of the input."""
+    if mode == EPHID_MODE_CBC:
+        return AES.new(key, AES.MODE_CBC, iv)
+    return AES.new(key, AES.MODE_ECB)
+
+
+def batch_generate_ephids(sks, iv_list, mode=EPHID_MODE, slots=N):
+    """Produces the EphIDs of many SKs at once, encrypting the common Broadcast Key with each of them.
+    The EphIDs are written in place in a single contiguous array, without building a bytes sequence for each SK.
+    Only the EphIDs of the first slots of the day can be produced, stopping the encryption of the Broadcast Key
+    right after the block of the last of them (see Encryptor.encrypt_until).
+    :param sks: a list of the bytes sequences representing the SKs
+    :param iv_list: a list of the IVs the Broadcast Key is encrypted with, one for each SK,
+        or the bytes sequence representing a single IV to use for all the SKs
+    :param mode: (Optional) the EphID derivation mode; if not specified, EPHID_MODE is used
+    :param slots: (Optional) the number of slots, from the first one of the day, to produce the EphIDs of;
+        if not specified, the EphIDs of all the N slots of the day are produced
+    :raises ValueError if the number of IVs and SKs are different, or the mode is not supported
+    :return ephids: a NumPy array of bytes of shape (len(sks), :param slots, BLOCK_SIZE),
+        such that ephids[i, j] is the EphID of the j-th slot of the day produced by the i-th SK"""
+    _check_mode(mode)
+    if isinstance(iv_list, bytes):
+        iv_list = repeat(iv_list, len(sks))
+    elif not len(iv_list) == len(sks):
+        raise ValueError(f'{len(iv_list)} IVs given for {len(sks)} SKs')
+
+    broadcast_key = get_broadcast_key()[:slots * BLOCK_SIZE]
+
+    ephids = np.empty((len(sks), slots, BLOCK_SIZE), dtype=np.uint8)
+    buffer = ephids.reshape(-1).data
+
+    # The input of the cipher for each IV (in EPHID_MODE_PRF, it depends on the IV)
+    inputs = {}
+    for i, (sk, iv) in enumerate(zip(sks, iv_list)):
+        if iv not in inputs:
+            inputs[iv] = broadcast_key if mode == EPHID_MODE_CBC else _xor_iv(broadcast_key, iv)
+        cipher = _new_cipher(sk, iv, mode)
+        cipher.encrypt(inputs[iv], output=buffer[i * len(broadcast_key):(i + 1) * len(broadcast_key)])
+
+    return ephids
+
+
 class Encryptor:
     """Class containing parameters and methods to produce the encryption of messages
     :param key: the bytes sequence representing the private encryption key
-    :param broadcast_key: the bytes sequence representing the common Broadcast Key"""
+    :param broadcast_key: the bytes sequence representing the common Broadcast Key, shared by all the objects
+    :param mode: the EphID derivation mode (see parameters.EPHID_MODES)"""
 
-    __slots__ = ['__key', '__broadcast_key']
+    __slots__ = ['__key', '__broadcast_key', '__mode']
 
-    def __init__(self, key):
+    def __init__(self, key, mode=EPHID_MODE):
         """Class constructor
-        :param key: the bytes sequence representing the private encryption key"""
+        :param key: the bytes sequence representing the private encryption key
+        :param mode: (Optional) the EphID derivation mode; if not specified, EPHID_MODE is used
+        :raises ValueError if the mode is not supported"""
+        _check_mode(mode)
         self.__key = key
-        self.__broadcast_key = _read_broadcast_key()
+        self.__broadcast_key = get_broadcast_key()
+        self.__mode = mode
+
+    def _encrypt(self, iv, msg):
+        """:returns the encryption of :param msg with :param iv in the EphID derivation mode of the object"""
+        if self.__mode == EPHID_MODE_CBC:
+            return _new_cipher(self.__key, iv, self.__mode).encrypt(msg)
+        return _new_cipher(self.__key, iv, self.__mode).encrypt(_xor_iv(msg, iv))
 
     def encrypt(self, iv=None, msg=None):
         """Produces the encryption of a message.
@@ -70,24 +169,48 @@ class Encryptor:
         if iv is None:
             iv = token_bytes(AES.block_size)
 
-        cipher = AES.new(self.__key, AES.MODE_CBC, iv)
-        ciphertext = cipher.encrypt(msg)
+        ciphertext = self._encrypt(iv, msg)
 
         return iv + ciphertext
 
+    def encrypt_until(self, iv, slot):
+        """Produces the EphIDs of the first slots of the day only, stopping the encryption of the Broadcast Key
+        right after the block of the given slot.
+        In EPHID_MODE_CBC, the EphID of a slot only depends on the IV and on the previous slots.
+        :param iv: the bytes sequence representing the Initialization Vector of the block cipher
+        :param slot: the index of the last slot to produce the EphID of
+        :returns the concatenation of the EphIDs of the slots from 0 to :param slot"""
+        return self._encrypt(iv, self.__broadcast_key[:(slot + 1) * BLOCK_SIZE])
+
+    def encrypt_slot(self, iv, slot):
+        """Produces the EphID of a single slot of the day.
+        In EPHID_MODE_PRF, a single block of the Broadcast Key is encrypted;
+        in EPHID_MODE_CBC, all the blocks up to the one of the slot have to be encrypted.
+        :param iv: the bytes sequence representing the Initialization Vector of the block cipher
+        :param slot: the index of the slot to produce the EphID of
+        :returns the bytes sequence representing the EphID of :param slot"""
+        if self.__mode == EPHID_MODE_CBC:
+            return self.encrypt_until(iv, slot)[-BLOCK_SIZE:]
+        return self._encrypt(iv, self.__broadcast_key[slot * BLOCK_SIZE:(slot + 1) * BLOCK_SIZE])
+
 
 class Decryptor:
     """Class containing parameters and methods to produce the decryption of ciphertexts
     :param key: the bytes sequence representing the private decryption key
-    :param broadcast_key: the bytes sequence representing the common Broadcast Key"""
+    :param broadcast_key: the bytes sequence representing the common Broadcast Key, shared by all the objects
+    :param mode: the EphID derivation mode (see parameters.EPHID_MODES)"""
 
-    __slots__ = ['__key', '__broadcast_key']
+    __slots__ = ['__key', '__broadcast_key', '__mode']
 
-    def __init__(self, key):
+    def __init__(self, key, mode=EPHID_MODE):
         """Class constructor
-        :param key: the bytes sequence representing the private decryption key"""
+        :param key: the bytes sequence representing the private decryption key
+        :param mode: (Optional) the EphID derivation mode; if not specified, EPHID_MODE is used
+        :raises ValueError if the mode is not supported"""
+        _check_mode(mode)
         self.__key = key
-        self.__broadcast_key = _read_broadcast_key()
+        self.__broadcast_key = get_broadcast_key()
+        self.__mode = mode
 
     def decrypt(self, ciphertext):
         """Produces the decryption of a ciphertext.
@@ -96,10 +219,43 @@ class Decryptor:
         :raises ValueError if the plaintext does not correspond to the common Broadcast Key
             (as the protocol states to always encrypt the Broadcast Key, with different private keys"""
         iv = ciphertext[:AES.block_size]
-        cipher = AES.new(self.__key, AES.MODE_CBC, iv)
+        cipher = _new_cipher(self.__key, iv, self.__mode)
         plaintext = cipher.decrypt(ciphertext[AES.block_size:])
+        if not self.__mode == EPHID_MODE_CBC:
+            plaintext = _xor_iv(plaintext, iv)
 
         if not plaintext == self.__broadcast_key:
             raise ValueError('Ciphertext not valid')
 
         return plaintext.rstrip(b'\0')
+
+    def match(self, iv, ephid, slot, tolerance=0):
+        """Checks if an EphID has been produced by the key, with a given IV, in a slot of the day close to the given one.
+        In EPHID_MODE_CBC, the EphID of slot i is AES(BK_i XOR C_i-1), where BK_i is the i-th block
+        of the common Broadcast Key and C_i-1 is the EphID of the previous slot (the IV for the first slot):
+        only the blocks of the Broadcast Key up to the last slot to check are encrypted, instead of the whole key.
+        In EPHID_MODE_PRF, the EphID of slot i is AES(BK_i XOR IV):
+        only the blocks of the Broadcast Key of the slots to check are encrypted.
+        :param iv: the bytes sequence representing the IV the EphID has been received with
+        :param ephid: the bytes sequence representing the received EphID
+        :param slot: the slot of the day the EphID has been received in
+        :param tolerance: (Optional) how many slots before and after :param slot the EphID is searched in
+        :returns the slot of the day the EphID corresponds to, or None if the key cannot produce it"""
+        first = max(slot - tolerance, 0)
+        last = min(slot + tolerance, N - 1)
+        if first > last:
+            return None
+
+        # The slot the first block of the produced ciphertext corresponds to
+        offset = 0 if self.__mode == EPHID_MODE_CBC else first
+
+        cipher = _new_cipher(self.__key, iv, self.__mode)
+        plaintext = self.__broadcast_key[offset * BLOCK_SIZE:(last + 1) * BLOCK_SIZE]
+        if not self.__mode == EPHID_MODE_CBC:
+            plaintext = _xor_iv(plaintext, iv)
+        ciphertext = cipher.encrypt(plaintext)
+
+        for i in range(first - offset, last - offset + 1):
+            if ciphertext[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE] == ephid:
+                return offset + i
+        return None
@@ -3,12 +3,54 @@ This module contains a method to produce the digest of messages with CRHF.
 """
 
 
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
 from Crypto.Hash import SHA256
 
 
+# Minimum number of messages each worker process hashes, below which the messages are hashed in the calling process
+MIN_MESSAGES_PER_WORKER = 4096
+
+
 def H(msg):
     """Returns the SHA-256 digest of msg. Note that everytime you call H, a new instatiation of SHA-256 will be created.
     If you want to produce the digest of A || B, don't use H(A) || H(B), but H(A || B)"""
     h = SHA256.new()
     h.update(msg)
     return h.digest()
+
+
+def H_chain(msg, times):
+    """Returns the digest of msg hashed times times with SHA-256, i.e. H(H(...H(msg))).
+    If times is 0, msg itself is returned.
+    The same digests as H are produced, but the hashlib implementation is used, which is much faster on short messages.
+    :param msg: the bytes sequence to hash
+    :param times: the number of times msg is hashed
+    :return digest: the bytes sequence representing the digest"""
+    for _ in range(times):
+        msg = sha256(msg).digest()
+    return msg
+
+
+def _H_chains(msgs, times):
+    """:returns a list of the digests of the messages in :param msgs, each hashed :param times times (see H_chain)"""
+    return [H_chain(msg, times) for msg in msgs]
+
+
+def H_chains(msgs, times, workers=1):
+    """Returns the digests of many messages, each hashed times times with SHA-256 (see H_chain).
+    If more than a worker is used, the messages are split in contiguous shards hashed by a pool of worker processes.
+    :param msgs: a list of the bytes sequences to hash
+    :param times: the number of times each message is hashed
+    :param workers: (Optional) the number of worker processes
+    :return digests: a list of the digests, in the same order as :param msgs"""
+    workers = min(workers, len(msgs) // MIN_MESSAGES_PER_WORKER)
+    if workers <= 1 or times == 0:
+        return _H_chains(msgs, times)
+
+    shard_size = -(-len(msgs) // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_H_chains, msgs[offset:offset + shard_size], times)
+                   for offset in range(0, len(msgs), shard_size)]
+        return [digest for future in futures for digest in future.result()]
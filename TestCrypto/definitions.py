@@ -5,6 +5,7 @@ This module contains the cryptografic tools parameters.
 import os
 
 from cipher import BLOCK_SIZE
+from signature_schemes import get_signature_scheme
 
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,14 +20,21 @@ EPHID_SIZE = BLOCK_SIZE
 
 # -------------------- SIGNATURE SCHEME PARAMETERS --------------------
 
-# Standard used to sign and verify messages: https://tools.ietf.org/html/rfc6979
-STANDARD = 'deterministic-rfc6979'
+# Name of the signature scheme used to sign and verify the EphIDs (see signature_schemes.SIGNATURE_SCHEMES).
+# All the users and the server have to use the same one
+SIGNATURE_SCHEME_NAME = 'ecdsa-p256'
+
+# Signature scheme used to sign and verify the EphIDs
+SIGNATURE_SCHEME = get_signature_scheme(SIGNATURE_SCHEME_NAME)
 
 # Curve used to generate the public key
-STANDARD_CURVE = 'P-256'
+STANDARD_CURVE = SIGNATURE_SCHEME.CURVE
+
+# Signature size of the signature scheme in bytes
+SIGNATURE_SIZE = SIGNATURE_SCHEME.SIGNATURE_SIZE
 
-# Signature size of the signature scheme in bytes. Change it if you change the curve
-SIGNATURE_SIZE = 64
+# Size in bytes of the public key of the signature scheme
+PUBLIC_KEY_SIZE = SIGNATURE_SCHEME.PUBLIC_KEY_SIZE
 
 # -------------------- GENERAL COMMUNICATION PARAMETERS --------------------
 
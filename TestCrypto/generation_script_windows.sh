@@ -6,6 +6,9 @@ rm -rf rootCA
 rm -rf intermediateCA
 rm -rf receiver/*.pem
 rm -rf receiver/*.txt
+rm -rf receiver/*.bin
+rm -rf receiver/*.filters
+rm -rf receiver/packets
 rm -rf sender/infected
 mkdir sender/infected
 rm -rf sender/not_infected
@@ -22,7 +25,7 @@ echo 01 > rootCA/serial
 echo "****** Installing libraries ******"
 sleep 3
 python get_pip.py
-pip install pycryptodome
+pip install pycryptodome numpy
 
 echo "****** Creating the private key for the rootCA ******"
 openssl genrsa  -out rootCA/private/rootCAkey.pem 4096
@@ -4,21 +4,118 @@ This module contains the methods and classes to generate both private and public
 
 
 from abc import ABC
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 import os
+import struct
 
 from Crypto.PublicKey import ECC
 from secrets import token_bytes
 
-from crhf import H
-from definitions import STANDARD_CURVE
+from crhf import H, H_chain
+from definitions import PUBLIC_KEY_SIZE, SIGNATURE_SCHEME, STANDARD_CURVE
 from parameters import SK_SIZE
 
-from utils import append_if_absent
+from utils import append_if_absent, write_atomically
 
 
-# Size in bytes of the public key. It depends on the Signature Algorithm (in this case, ECC)
-PUBLIC_KEY_SIZE = 2 * SK_SIZE
+# Maximum number of ECC-public keys kept by the cache of the constructed keys
+PUBLIC_KEY_CACHE_SIZE = 1024
+
+# Number of days between two SKs stored in the checkpoint table of each hash chain of SKs
+SK_CHECKPOINT_INTERVAL = 4
+
+# Maximum number of hash chains of SKs whose checkpoint table is kept
+SK_CHAIN_TABLE_SIZE = 1024
+
+# Layout of a record of the file the checkpoint tables are stored in: the first SK of the chain, the day it is valid in
+# (e.g. 2020-06-01), the position of the checkpoint in the table of the chain and the SK of the checkpoint
+SK_CHAIN_RECORD_FORMAT = f'!{SK_SIZE}s10sH{SK_SIZE}s'
+
+
+class SKChainTable:
+    """Class containing the checkpoint tables of many hash chains of SKs,
+    where the SK of a day is H(SK of the day before).
+    For each chain, identified by an SK and the day it is valid in, the SK of every interval-th day is stored,
+    so that the SK of any following day is derived from the closest previous checkpoint with less than interval hashes,
+    instead of hashing the first SK once for each day passed.
+    The tables can be stored in a binary file, so that the checkpoints computed by a process are reused by the following
+    ones: each record of the file is a checkpoint of a chain (see SK_CHAIN_RECORD_FORMAT).
+    :param path: the file the tables are stored in, or None if they are only kept in memory
+    :param interval: the number of days between two checkpoints of a chain
+    :param size: the maximum number of chains kept; when it is exceeded, the least recently used chain is discarded
+    :param tables: a dictionary mapping each chain (SK, day) to the list of its checkpoints,
+        such that tables[chain][k] is the SK of the (k * interval)-th day after the first one"""
+
+    __slots__ = ['__path', '__interval', '__size', '__tables']
+
+    def __init__(self, path=None, interval=SK_CHECKPOINT_INTERVAL, size=SK_CHAIN_TABLE_SIZE):
+        """Class constructor.
+        Reads the tables from the file, if it exists
+        :param path: (Optional) the file the tables are stored in; if not specified, they are only kept in memory
+        :param interval: (Optional) the number of days between two checkpoints of a chain
+        :param size: (Optional) the maximum number of chains kept"""
+        self.__path = path
+        self.__interval = interval
+        self.__size = size
+        self.__tables = {}
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        """Reads the tables from the file. A missing file, or a record only partially written at its end, is ignored."""
+        try:
+            with open(self.__path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        record_size = struct.calcsize(SK_CHAIN_RECORD_FORMAT)
+        for (sk, day, k, checkpoint) in struct.iter_unpack(SK_CHAIN_RECORD_FORMAT,
+                                                           data[:len(data) - len(data) % record_size]):
+            table = self.__tables.setdefault((sk, date.fromisoformat(day.decode())), [sk])
+            if k == len(table):
+                table.append(checkpoint)
+
+        while len(self.__tables) > self.__size:
+            del self.__tables[next(iter(self.__tables))]
+
+    def save(self):
+        """Writes the tables to the file (see write_atomically),
+        from the least recently used chain to the most recently used one.
+        If the tables are only kept in memory, nothing is written."""
+        if self.__path is None:
+            return
+
+        records = [struct.pack(SK_CHAIN_RECORD_FORMAT, sk, day.isoformat().encode(), k, table[k])
+                   for ((sk, day), table) in self.__tables.items() for k in range(1, len(table))]
+        write_atomically(self.__path, b''.join(records))
+
+    def derive_sk(self, sk, from_date, to_date):
+        """Derives the SK of a day from the SK of a previous day, i.e. H applied once for each day passed.
+        The missing checkpoints of the chain up to :param to_date are computed and stored.
+        For example, if :param to_date is the day after :param from_date, then H(SK) is returned.
+        :param sk: the bytes sequence representing the SK of :param from_date
+        :param from_date: a datetime object representing the day :param sk is valid in
+        :param to_date: a datetime object representing the day to derive the SK of
+        :raises ValueError if :param to_date is before :param from_date
+        :return sk: the bytes sequence representing the SK of :param to_date"""
+        days = (to_date.date() - from_date.date()).days
+        if days < 0:
+            raise ValueError(f'Cannot derive the SK of {to_date.date()} from the SK of {from_date.date()}')
+
+        # The chain is moved to the end of the dictionary, as the most recently used one
+        chain = (sk, from_date.date())
+        table = self.__tables.pop(chain, [sk])
+        self.__tables[chain] = table
+        if len(self.__tables) > self.__size:
+            del self.__tables[next(iter(self.__tables))]
+
+        checkpoint, remaining = divmod(days, self.__interval)
+        while len(table) <= checkpoint:
+            table.append(H_chain(table[-1], self.__interval))
+
+        return H_chain(table[checkpoint], remaining)
 
 
 class Key(ABC):
@@ -74,19 +171,19 @@ class Key(ABC):
         :param last_update: a datetime object representing the last time the SK has been updated
         :param sk: the SK to update
         :return sk: the updated SK"""
-        days = (datetime.now() - last_update).days
+        now = datetime.now()
+        days = (now - last_update).days
 
         if not days > 0:
             return sk
 
-        for _ in range(days):
-            sk = H(sk)
+        sk = H_chain(sk, days)
 
         with open(os.path.join(self.directory(), self.SK_FILE), "wb") as f:
             f.write(sk)
 
         with open(os.path.join(self.directory(), self.LAST_SK_UPDATE_FILE), "w") as f:
-            f.write(datetime.now().strftime(self.LAST_UPDATE_DATE_FORMAT))
+            f.write(now.strftime(self.LAST_UPDATE_DATE_FORMAT))
 
         return sk
 
@@ -148,11 +245,13 @@ class PrivateSK(Key):
 
 class PublicSK(Key):
     """A class representing a public SK and the corresponding Public-Private key pairs it is generated from.
-    This class uses ECC as key-generation algorithms.
+    This class uses ECC as key-generation algorithms, on the curve of the signature scheme in use.
     :param sk: the bytes sequence representing the SK held by the class
     :param curve: the elliptic curve used to generate the keys
     :param x: the x-coordinate of the point on the elliptic curve used to generate the keys
-    :param y: the y-coordinate of the point on the elliptic curve used to generate the keys"""
+    :param y: the y-coordinate of the point on the elliptic curve used to generate the keys
+    :param public_key: the bytes sequence representing the public key, as encoded by the signature scheme
+    :param private_key: the EccKey object holding the private key"""
 
     # Directory in which the files containing the public SK will be stored
     DIRECTORY = "infected"
@@ -161,7 +260,7 @@ class PublicSK(Key):
     PRIVATE_KEY_FILE = "private_key_ecc.pem"
 
     # Size of both x and y points in bytes
-    COORDINATE_SIZE = PUBLIC_KEY_SIZE // 2
+    COORDINATE_SIZE = SIGNATURE_SCHEME.COORDINATE_SIZE
 
     # File the public key is stored in
     PUBLIC_KEY_FILE = "public_key_ecc.pem"
@@ -169,7 +268,7 @@ class PublicSK(Key):
     # Format the keys are saved with
     KEY_FORMAT = "PEM"
 
-    __slots__ = ['__curve', '__x', '__y']
+    __slots__ = ['__curve', '__x', '__y', '__public_key', '__private_key']
 
     def __init__(self, curve=STANDARD_CURVE):
         """Class constructor.
@@ -193,17 +292,22 @@ class PublicSK(Key):
         """:returns the bytes sequence representing :param y"""
         return int(self.__y).to_bytes(self.COORDINATE_SIZE, 'big')
 
+    def public_key_bytes(self):
+        """:returns the bytes sequence representing :param public_key"""
+        return self.__public_key
+
     def _get_sk_from_file(self):
         """Reads the public SK and the ECC-keys from the corresponding files.
         If the file doesn't exist, a new one will be created, containing:
-            a new SK = H(x || y) where:
+            a new SK = H(public key) where:
                 H is a CRHF
-                x is the bytes sequence representing :param x
-                y is the bytes sequence representing :param y
-                x and y are the coordinates of the point on an elliptic curve used to generate a new pair of keys
+                public key is the bytes sequence representing the public key of a new pair of keys
+                (for ECDSA, the concatenation of the coordinates x and y of its point on the elliptic curve)
             a new ECC-private key
             a new ECC-public key
-        Stores x and y as ECCPoint objects in :param x and in :param y
+        Stores x and y as ECCPoint objects in :param x and in :param y,
+        the bytes sequence representing the public key in :param public_key,
+        and the EccKey object holding the private key in :param private_key
         :return sk: the bytes sequence representing the content of the file storing the SK"""
         sk_path = os.path.join(self.directory(), self.SK_FILE)
         public_key_path = os.path.join(self.directory(), self.PUBLIC_KEY_FILE)
@@ -216,6 +320,8 @@ class PublicSK(Key):
                 point = key.pointQ
                 self.__x = point.x
                 self.__y = point.y
+                self.__public_key = SIGNATURE_SCHEME.public_key_bytes(key)
+                self.__private_key = key
         except FileNotFoundError:
             with open(sk_path, "wb") as f:
                 key = ECC.generate(curve=self.__curve)
@@ -226,10 +332,9 @@ class PublicSK(Key):
                 point = key.pointQ
                 self.__x = point.x
                 self.__y = point.y
-                x = self.x_bytes()
-                y = self.y_bytes()
-                sk = x + y
-                sk = H(sk)
+                self.__public_key = SIGNATURE_SCHEME.public_key_bytes(key)
+                self.__private_key = key
+                sk = H(self.__public_key)
                 f.write(sk)
         return sk
 
@@ -238,61 +343,58 @@ class PublicSK(Key):
         return os.path.join(self.directory(), self.PRIVATE_KEY_FILE)
 
     def export_public_key(self, file):
-        """Appends the concatenation of the bytes sequences representing :param x and :param y in :param file
+        """Appends the bytes sequence representing the public key in :param file
         :param file: the file in which the public key will be stored"""
-        x = self.x_bytes()
-        y = self.y_bytes()
-        public_key = x + y
-
-        append_if_absent(public_key, PUBLIC_KEY_SIZE, file)
+        append_if_absent(self.__public_key, PUBLIC_KEY_SIZE, file)
 
     def get_private_key(self):
-        key = ECC.import_key(open(self.private_key_path()).read())
-        return key
+        """:returns the EccKey object holding the private key, imported from its file only once"""
+        return self.__private_key
 
     @staticmethod
+    @lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
     def construct_public_key(xy):
         """Constructs an ECC-public key starting from the bytes sequences representing the public key.
-        :param xy: the bytes sequences representing the public key,
-            as of the concatenation of the bytes sequences representing :param x and :param y
-        :returns an EccKey object containing the public key corresponding to the couple of coordinates x and y"""
-        coordinate_size = len(xy) // 2
-        x = int.from_bytes(xy[:coordinate_size], 'big')
-        y = int.from_bytes(xy[coordinate_size:], 'big')
-        return ECC.construct(curve=STANDARD_CURVE, point_x=x, point_y=y)
+        The last PUBLIC_KEY_CACHE_SIZE constructed keys are cached, so that the point validation on the curve
+        is not performed again for the same public key (see public_key_cache_info).
+        :param xy: the bytes sequences representing the public key, as encoded by the signature scheme
+            (for ECDSA, the concatenation of the bytes sequences representing :param x and :param y)
+        :raises ValueError if :param xy does not represent a point of the curve
+        :returns an EccKey object containing the public key"""
+        return SIGNATURE_SCHEME.construct_public_key(xy)
+
+    @staticmethod
+    def public_key_cache_info():
+        """:returns the statistics of the cache of the constructed ECC-public keys,
+            as a named tuple (hits, misses, maxsize, currsize)"""
+        return PublicSK.construct_public_key.cache_info()
 
     @staticmethod
     def construct_sk(public_key):
         """Computes the SK corresponding to an ECC-public key.
         :param public_key: an EccKey object containing the public key
-        :return sk: SK = H(x || y) where:
+        :return sk: SK = H(public key) where:
             H is a CRHF
-            x is the bytes sequence representing :param x
-            y is the bytes sequence representing :param y
-            x and y are the coordinates of the point on an elliptic curve used to generate :param public_key"""
-        point = public_key.pointQ
-        x = int(point.x).to_bytes(PUBLIC_KEY_SIZE // 2, 'big')
-        y = int(point.y).to_bytes(PUBLIC_KEY_SIZE // 2, 'big')
-        sk = x + y
-        return H(sk)
+            public key is the bytes sequence representing :param public_key, as encoded by the signature scheme
+            (for ECDSA, the concatenation of the coordinates x and y of its point on the elliptic curve)"""
+        return H(SIGNATURE_SCHEME.public_key_bytes(public_key))
 
     @staticmethod
     def get_x_bytes(public_key):
         """:returns a bytes sequence representing :param x"""
         point = public_key.pointQ
-        x = int(point.x).to_bytes(PUBLIC_KEY_SIZE // 2, 'big')
+        x = int(point.x).to_bytes(PublicSK.COORDINATE_SIZE, 'big')
         return x
 
     @staticmethod
     def get_y_bytes(public_key):
         """:returns a bytes sequence representing :param y"""
         point = public_key.pointQ
-        y = int(point.y).to_bytes(PUBLIC_KEY_SIZE // 2, 'big')
+        y = int(point.y).to_bytes(PublicSK.COORDINATE_SIZE, 'big')
         return y
 
     @staticmethod
     def get_public_key_bytes(public_key):
-        """:returns the concatenation of the bytes sequences representing :param x and :param y"""
-        x = PublicSK.get_x_bytes(public_key)
-        y = PublicSK.get_y_bytes(public_key)
-        return x + y
+        """:returns the bytes sequence representing :param public_key, as encoded by the signature scheme
+            (for ECDSA, the concatenation of the bytes sequences representing :param x and :param y)"""
+        return SIGNATURE_SCHEME.public_key_bytes(public_key)
@@ -17,3 +17,19 @@ L = 10
 
 # Number of EphIDs generated each day
 N = 24 * 60 // L
+
+# -------------------- EPHID DERIVATION MODES --------------------
+
+# Version 1: the Broadcast Key is encrypted with SK in CBC mode, so the EphID of a slot is AES_SK(BK_i XOR EphID_i-1)
+# (the IV for the first slot), and it can be produced only after the EphIDs of all the previous slots
+EPHID_MODE_CBC = 1
+
+# Version 2: each block of the Broadcast Key is encrypted on its own, so the EphID of a slot is AES_SK(BK_i XOR IV),
+# and it can be produced with a single block operation
+EPHID_MODE_PRF = 2
+
+# Supported EphID derivation modes
+EPHID_MODES = (EPHID_MODE_CBC, EPHID_MODE_PRF)
+
+# EphID derivation mode used by the senders and the receivers. All the users have to use the same one
+EPHID_MODE = EPHID_MODE_CBC
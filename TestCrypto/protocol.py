@@ -0,0 +1,133 @@
+"""
+This module contains the framed protocol the receivers and the server communicate with.
+Each frame is made of a header (protocol version, frame type, payload size) followed by the payload.
+"""
+
+import struct
+
+from definitions import EPHID_SIZE, PUBLIC_KEY_SIZE, SIGNATURE_SIZE
+
+
+# Version of the protocol. Frames with a different version are rejected
+PROTOCOL_VERSION = 1
+
+# Header of each frame: version (1 byte), type (1 byte), size in bytes of the payload (4 bytes)
+HEADER = struct.Struct('!BBI')
+
+# Size in bytes of the header of each frame
+HEADER_SIZE = HEADER.size
+
+# Size in bytes of a report sent to the server (public key + EphID + tag)
+REPORT_SIZE = PUBLIC_KEY_SIZE + EPHID_SIZE + SIGNATURE_SIZE
+
+# Maximum number of reports in a single frame
+MAX_REPORTS = 1024
+
+# -------------------- FRAME TYPES --------------------
+
+# Server -> receiver: the welcome message of the server
+WELCOME = 0
+
+# Receiver -> server: a batch of reports
+REPORTS = 1
+
+# Server -> receiver: the status of each report of a batch, one byte for each report
+STATUSES = 2
+
+# Server -> receiver: the description of an error; the connection is closed right after it
+ERROR = 3
+
+# Server -> receiver: the server is too busy to serve the receiver, which should retry later;
+# the connection is closed right after it
+BUSY = 4
+
+# -------------------- REPORT STATUSES --------------------
+
+# The signature of the report is not valid
+INVALID_SIGNATURE = 0
+
+# The signature of the report is valid
+VALID_SIGNATURE = 1
+
+# The report is not valid (e.g. the public key is not a point of the curve)
+INVALID_REPORT = 2
+
+STATUS_MESSAGES = {
+    INVALID_SIGNATURE: 'Thanks for your help :( but you are trying to scam the system...',
+    VALID_SIGNATURE: 'Thanks for your help :) the subject has violated the quarantine!',
+    INVALID_REPORT: 'The message is not valid.',
+}
+
+
+def encode_frame(frame_type, payload):
+    """Builds a frame.
+    :param frame_type: the type of the frame
+    :param payload: the bytes sequence representing the payload of the frame
+    :returns the bytes sequence representing the frame"""
+    return HEADER.pack(PROTOCOL_VERSION, frame_type, len(payload)) + payload
+
+
+def decode_header(header):
+    """Parses the header of a frame.
+    :param header: the bytes sequence representing the header, of HEADER_SIZE bytes
+    :raises ValueError if the version of the frame is not supported, or its payload is too long
+    :return frame_type: the type of the frame
+    :return size: the size in bytes of the payload of the frame"""
+    version, frame_type, size = HEADER.unpack(header)
+    if not version == PROTOCOL_VERSION:
+        raise ValueError(f'Protocol version {version} not supported')
+    if size > MAX_REPORTS * REPORT_SIZE:
+        raise ValueError(f'Frame of {size} bytes too long')
+    return frame_type, size
+
+
+def encode_reports(reports):
+    """Builds a frame containing a batch of reports.
+    :param reports: a list of the bytes sequences representing the reports, of REPORT_SIZE bytes each
+    :raises ValueError if the size of a report is not REPORT_SIZE, or there are more than MAX_REPORTS reports
+    :returns the bytes sequence representing the frame"""
+    if len(reports) > MAX_REPORTS:
+        raise ValueError(f'{len(reports)} reports are more than {MAX_REPORTS}')
+    if any(len(report) != REPORT_SIZE for report in reports):
+        raise ValueError('Report incorrect size')
+    return encode_frame(REPORTS, b''.join(reports))
+
+
+def decode_reports(payload):
+    """Splits the payload of a frame in the reports it contains.
+    :param payload: the bytes sequence representing the payload
+    :raises ValueError if the payload is empty or its size is not a multiple of REPORT_SIZE
+    :returns a list of the bytes sequences representing the reports"""
+    if not payload or not len(payload) % REPORT_SIZE == 0:
+        raise ValueError('Payload does not contain proper reports')
+    return [payload[i:i + REPORT_SIZE] for i in range(0, len(payload), REPORT_SIZE)]
+
+
+def encode_statuses(statuses):
+    """Builds a frame containing the status of each report of a batch.
+    :param statuses: a list of the statuses of the reports
+    :returns the bytes sequence representing the frame"""
+    return encode_frame(STATUSES, bytes(statuses))
+
+
+def read_frame(sock):
+    """Reads a whole frame from a blocking socket.
+    :param sock: the socket to read the frame from
+    :raises ConnectionError if the connection is closed before the whole frame is read
+    :raises ValueError if the header of the frame is not valid
+    :return frame_type: the type of the frame
+    :return payload: the bytes sequence representing the payload of the frame"""
+    frame_type, size = decode_header(_read_exactly(sock, HEADER_SIZE))
+    return frame_type, _read_exactly(sock, size)
+
+
+def _read_exactly(sock, size):
+    """Reads exactly size bytes from a blocking socket.
+    :raises ConnectionError if the connection is closed before size bytes are read"""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed by the peer')
+        data += chunk
+    return data
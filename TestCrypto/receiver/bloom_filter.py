@@ -0,0 +1,91 @@
+"""
+This module contains a Bloom filter, used to quickly discard the received EphIDs that no infected user can generate.
+"""
+
+import struct
+from math import ceil, log
+
+import numpy as np
+
+from definitions import EPHID_SIZE
+
+
+# Format of the header of a stored filter: its number of bits and its number of hash functions
+HEADER_FORMAT = '!QI'
+
+
+class BloomFilter:
+    """Class containing a probabilistic set of EphIDs, that can tell if an EphID is surely not in the set,
+    or if it may be in it with a given false positive rate.
+    Since EphIDs are outputs of a block cipher, their bytes are used directly as hash values:
+    the k positions of an EphID are h1 + i * h2 (i = 0, ..., k - 1), where h1 and h2 are its two halves.
+    :param size: the number of bits of the filter
+    :param hashes: the number of positions each EphID sets in the filter
+    :param bits: a NumPy array of bytes holding the bits of the filter"""
+
+    __slots__ = ['__size', '__hashes', '__bits']
+
+    def __init__(self, capacity, fp_rate):
+        """Class constructor.
+        Computes the optimal number of bits and of hash functions of the filter.
+        :param capacity: the number of EphIDs the filter is meant to contain
+        :param fp_rate: the probability that an EphID not in the filter is reported as contained in it,
+            once the filter holds :param capacity EphIDs
+        :raises ValueError if :param fp_rate is not between 0 and 1"""
+        if not 0 < fp_rate < 1:
+            raise ValueError(f'False positive rate {fp_rate} is not between 0 and 1')
+
+        capacity = max(capacity, 1)
+        self.__size = max(ceil(-capacity * log(fp_rate) / log(2) ** 2), 8)
+        self.__hashes = max(round(self.__size / capacity * log(2)), 1)
+        self.__bits = np.zeros(ceil(self.__size / 8), dtype=np.uint8)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Reads a filter from the bytes sequence representing it.
+        :param data: the bytes sequence representing the filter, as returned by to_bytes
+        :raises ValueError if :param data does not represent a filter
+        :returns a BloomFilter object"""
+        header_size = struct.calcsize(HEADER_FORMAT)
+        if len(data) < header_size:
+            raise ValueError('Bloom filter too short')
+
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.__size, bloom_filter.__hashes = struct.unpack(HEADER_FORMAT, data[:header_size])
+        bloom_filter.__bits = np.frombuffer(data, dtype=np.uint8, offset=header_size).copy()
+        if not len(bloom_filter.__bits) == ceil(bloom_filter.__size / 8):
+            raise ValueError('Bloom filter size not valid')
+        return bloom_filter
+
+    def to_bytes(self):
+        """:returns the bytes sequence representing the filter"""
+        return struct.pack(HEADER_FORMAT, self.__size, self.__hashes) + self.__bits.tobytes()
+
+    def _positions(self, ephids):
+        """Computes the positions of the filter corresponding to many EphIDs.
+        :param ephids: a NumPy array of bytes whose last dimension has size EPHID_SIZE
+        :returns a NumPy array of shape (number of EphIDs, number of hashes) holding the positions of each EphID"""
+        halves = np.ascontiguousarray(ephids).reshape(-1, EPHID_SIZE).view(np.uint64)
+        h1 = halves[:, :1]
+        h2 = halves[:, 1:] | np.uint64(1)
+        steps = np.arange(self.__hashes, dtype=np.uint64)
+        return (h1 + steps * h2) % np.uint64(self.__size)
+
+    def add(self, ephids):
+        """Adds many EphIDs to the filter.
+        :param ephids: a NumPy array of bytes whose last dimension has size EPHID_SIZE"""
+        # The positions are set in a boolean array holding a byte for each bit, which is then packed into the bits
+        # of the filter: setting the same byte many times in a single assignment is harmless,
+        # while setting different bits of the same byte of the filter would keep only one of them
+        positions = np.zeros(len(self.__bits) * 8, dtype=bool)
+        positions[self._positions(ephids).reshape(-1)] = True
+        self.__bits |= np.packbits(positions, bitorder='little')
+
+    def contains(self, ephids):
+        """Checks if many EphIDs may be in the filter.
+        :param ephids: a NumPy array of bytes whose last dimension has size EPHID_SIZE
+        :returns a NumPy array of booleans, True for each EphID that may be in the filter
+            and False for each EphID that is surely not in it"""
+        positions = self._positions(ephids)
+        bits = (self.__bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
@@ -0,0 +1,77 @@
+"""
+This module contains the checkpoint of the matching, so that each run only matches what is new since the previous one.
+"""
+
+from key_generator import Key
+
+from utils import write_atomically
+
+
+class MatchCheckpoint:
+    """Class containing how many SKs of the infected users and how many packets of each day have already been matched,
+    stored in a text file.
+    The first line of the file is the number of matched SKs,
+    and each of the following lines contains a day and the number of matched packets received in it.
+    The SKs of the previous days are derived from the first SK received of each infected user,
+    and the new infected users are only appended after the others,
+    so the checkpoint stays valid when the SKs are updated at the day rollover.
+    :param path: the file the checkpoint is stored in
+    :param sks: the number of SKs already matched
+    :param packets: a dictionary mapping the string representing each day
+        to the number of its packets already matched"""
+
+    __slots__ = ['__path', '__sks', '__packets']
+
+    def __init__(self, path):
+        """Class constructor.
+        Reads the checkpoint from the file, if it exists
+        :param path: the file the checkpoint is stored in"""
+        self.__path = path
+        self.reset()
+        self._load()
+
+    def _load(self):
+        """Reads the checkpoint from the file. A missing or malformed file is ignored."""
+        try:
+            with open(self.__path, "r") as f:
+                lines = f.read().split()
+        except FileNotFoundError:
+            return
+
+        if not len(lines) % 2 == 1:
+            return
+
+        try:
+            sks = int(lines[0])
+            packets = {day: int(count) for (day, count) in zip(lines[1::2], lines[2::2])}
+        except ValueError:
+            return
+
+        self.__sks = sks
+        self.__packets = packets
+
+    def reset(self):
+        """Forgets what has been matched, so that everything is matched again."""
+        self.__sks = 0
+        self.__packets = {}
+
+    def sks(self):
+        """:returns the number of SKs of the infected users already matched"""
+        return self.__sks
+
+    def packets(self, day):
+        """:returns the number of packets received in :param day already matched"""
+        return self.__packets.get(day.strftime(Key.LAST_UPDATE_DATE_FORMAT), 0)
+
+    def update(self, sks, packets):
+        """Records what has been matched.
+        :param sks: the number of SKs matched
+        :param packets: a dictionary mapping each day (as a datetime object) to the number of its packets matched;
+            the days not in it (e.g. no longer retained) are forgotten"""
+        self.__sks = sks
+        self.__packets = {day.strftime(Key.LAST_UPDATE_DATE_FORMAT): count for (day, count) in packets.items()}
+
+    def save(self):
+        """Writes the checkpoint to the file (see write_atomically)."""
+        lines = [str(self.__sks)] + [f'{day} {count}' for (day, count) in sorted(self.__packets.items())]
+        write_atomically(self.__path, '\n'.join(lines) + '\n', "w")
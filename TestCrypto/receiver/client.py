@@ -3,12 +3,13 @@
 import socket
 import ssl
 
+from protocol import MAX_REPORTS, BUSY, STATUSES, STATUS_MESSAGES, encode_reports, read_frame
+
 COMMON_NAME = "www.serverDP3T.com"
 FILENAME = "./to_server.pem"
 SERVER_BACKEND_CERT_PATH = "../intermediateCA/certs/intermediateCA-rootCA-chain.cert.pem"
 HOST = "127.0.0.1"
 PORT = 8443
-MAX_MESSAGE_SIZE = 512
 
 COUNTRY_NAME = "IT"
 # COMMON_NAME = "www.serverDP3T.com"
@@ -18,6 +19,9 @@ COUNTRY_NAME_ISSUER = "IT"
 COMMON_NAME_ISSUER = "min.gov.salute"
 ORGANIZATION_NAME_ISSUER = "Ministero della Salute"
 
+# The SSL context shared by all the connections to the server, created the first time it is needed
+_context = None
+
 
 def verify_server(cert):
     """
@@ -40,34 +44,108 @@ def verify_server(cert):
         raise Exception("Certificate of rootCA is not valid")
 
 
-def send_data_to_server(data):
-    # opening a socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((HOST, PORT))
-    context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-    context.verify_mode = ssl.CERT_REQUIRED
-    context.load_verify_locations(SERVER_BACKEND_CERT_PATH)
-    secure_sock = context.wrap_socket(sock, server_hostname=HOST, server_side=False)
-
-    # get the server certificate and verify it
-    cert = secure_sock.getpeercert()
-    try:
-        verify_server(cert)
-    except Exception as e:
-        print(str(e))
-        raise SystemExit
-
-    # reading and printing the welcome message from the server
-    received_data = secure_sock.read(MAX_MESSAGE_SIZE)
-    print(received_data)
-
-    # reading the data to send (in the real scenario, this file comes from the bluetooth comunication)
-    secure_sock.write(data)
-
-    # reading and printing the response from the server
-    received_data = secure_sock.read(MAX_MESSAGE_SIZE)
-    print(received_data)
-
-    # closing the connection
-    secure_sock.close()
-    sock.close()
+def get_ssl_context():
+    """
+    Returns the SSL context of the client, loading the certificate chain of the authorities the first time it is needed.
+    The same context is used by all the connections of the process, so that their TLS sessions can be resumed.
+    :returns: the SSL context of the client
+    """
+    global _context
+    if _context is None:
+        _context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        _context.verify_mode = ssl.CERT_REQUIRED
+        _context.load_verify_locations(SERVER_BACKEND_CERT_PATH)
+    return _context
+
+
+class ServerConnection:
+    """
+    Class representing a connection to the server, which can carry many messages.
+    If a previous connection has been established, its TLS session is resumed, avoiding a full handshake.
+    :param sock: the SSLSocket object connected to the server
+    """
+
+    # The TLS session of the last connection to the server
+    _session = None
+
+    __slots__ = ['__sock']
+
+    def __init__(self):
+        """
+        Class constructor.
+        Connects to the server, verifies its certificate and prints its welcome message.
+        :raise SystemExit: if the certificate of the server is not valid
+        :raise ConnectionRefusedError: if the server is too busy to serve the client
+        """
+        # opening a socket
+        sock = socket.create_connection((HOST, PORT))
+        self.__sock = get_ssl_context().wrap_socket(sock, server_hostname=HOST, server_side=False,
+                                                    session=ServerConnection._session)
+
+        # get the server certificate and verify it
+        cert = self.__sock.getpeercert()
+        try:
+            verify_server(cert)
+        except Exception as e:
+            print(str(e))
+            self.close()
+            raise SystemExit
+
+        ServerConnection._session = self.__sock.session
+
+        # reading and printing the welcome message from the server
+        frame_type, received_data = read_frame(self.__sock)
+        if frame_type == BUSY:
+            self.close()
+            raise ConnectionRefusedError(received_data.decode())
+        print(received_data)
+
+    def session_reused(self):
+        """:returns: True if the TLS session of a previous connection has been resumed, False otherwise"""
+        return self.__sock.session_reused
+
+    def send(self, reports):
+        """
+        Sends a batch of reports to the server, in frames of at most MAX_REPORTS reports each.
+        :param reports: a list of the reports to send
+        :returns: a list of the statuses of the reports, in the same order
+        :raise ValueError: if the server rejects a frame
+        """
+        statuses = []
+        for i in range(0, len(reports), MAX_REPORTS):
+            self.__sock.sendall(encode_reports(reports[i:i + MAX_REPORTS]))
+            frame_type, payload = read_frame(self.__sock)
+            if not frame_type == STATUSES:
+                raise ValueError(payload.decode())
+            statuses.extend(payload)
+        return statuses
+
+    def close(self):
+        """Closes the connection."""
+        self.__sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def send_data_to_server(reports, connection=None):
+    """
+    Sends a batch of reports to the server in a single round trip, and prints the status of each of them.
+    :param reports: a list of the reports to send
+    :param connection: (Optional) the ServerConnection object to send the reports on;
+        if not specified, a new connection is opened and closed after the reports are sent
+    :returns: a list of the statuses of the reports, in the same order
+    """
+    if connection is None:
+        with ServerConnection() as connection:
+            return send_data_to_server(reports, connection)
+
+    # sending the data (in the real scenario, this file comes from the bluetooth comunication)
+    # reading and printing the response from the server for each report
+    statuses = connection.send(reports)
+    for status in statuses:
+        print(STATUS_MESSAGES[status])
+    return statuses
@@ -0,0 +1,240 @@
+"""
+This module contains the cache of the EphIDs produced by the SKs of the infected users.
+"""
+
+import mmap
+import os
+import shutil
+from datetime import datetime
+from hashlib import sha256
+
+import numpy as np
+
+from cipher import batch_generate_ephids
+from definitions import EPHID_SIZE
+from key_generator import Key
+from parameters import N, EPHID_MODE
+
+from receiver.bloom_filter import BloomFilter
+from receiver.rec_definitions import EPHID_CACHE_MAX_SIZE
+
+from utils import write_atomically
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+
+# Size in bytes of the key each record of the cache is stored with
+CACHE_KEY_SIZE = 32
+
+# Number of bytes at the beginning of each key the records are sorted by
+KEY_HEAD_SIZE = 8
+
+# Suffix of the directory, next to the file of the cache, the Bloom filters of the EphIDs are stored in
+FILTERS_DIR_SUFFIX = ".filters"
+
+# Layout of a record of the cache: the key followed by the N EphIDs it corresponds to
+RECORD_DTYPE = np.dtype([('key', np.uint8, (CACHE_KEY_SIZE,)), ('ephids', np.uint8, (N, EPHID_SIZE))])
+
+
+def _key_heads(keys):
+    """:returns the first KEY_HEAD_SIZE bytes of each of :param keys, a NumPy array of bytes of shape
+        (number of keys, CACHE_KEY_SIZE), as a NumPy array of big endian integers"""
+    return np.ascontiguousarray(keys[:, :KEY_HEAD_SIZE]).view(f'>u{KEY_HEAD_SIZE}').reshape(-1)
+
+
+class EphIDCache:
+    """Class containing the EphIDs produced by the SKs of the infected users, stored in a binary file.
+    Each record of the file is made of the key H(date || mode || SK || IV), followed by the N EphIDs produced by SK
+    with IV in the EphID derivation mode, so that the records of a different mode are never used.
+    The file is memory mapped the first time it is needed, and the missing records are appended to it.
+    Since the keys are hashes, the records are indexed by sorting the first bytes of their keys:
+    loading the cache costs a sort, and looking up many keys costs a binary search for each of them.
+    Next to the file, the cache stores the Bloom filters of the EphIDs produced by a set of SKs with an IV.
+    Neither the file nor the directory of the filters grows beyond a maximum size: once it is reached, the missing
+    records and filters are still produced, but they are no longer stored.
+    A cache can be passed to other processes: each of them maps the file on its own.
+    :param path: the file the cache is stored in
+    :param date: the bytes sequence representing the date of the SKs
+    :param mode: the EphID derivation mode the EphIDs are produced in
+    :param max_size: the maximum size in bytes of the file, and of the directory of the filters
+    :param records: the memory mapped records of the file
+    :param heads: a sorted NumPy array of the first bytes of the keys of the records, as integers
+    :param order: a NumPy array of the positions of the records, in the order of :param heads
+    :param appended: a dictionary mapping the key of each record appended since the file was mapped to its EphIDs"""
+
+    __slots__ = ['__path', '__date', '__mode', '__max_size', '__records', '__heads', '__order', '__appended']
+
+    def __init__(self, path, date=None, mode=EPHID_MODE, max_size=EPHID_CACHE_MAX_SIZE):
+        """Class constructor
+        :param path: the file the cache is stored in
+        :param date: (Optional) a datetime object representing the day the SKs are valid in;
+            if not specified, the current date is used
+        :param mode: (Optional) the EphID derivation mode; if not specified, EPHID_MODE is used
+        :param max_size: (Optional) the maximum size in bytes of the file, and of the directory of the filters;
+            if not specified, EPHID_CACHE_MAX_SIZE is used"""
+        self.__path = path
+        self.__date = (date or datetime.now()).strftime(Key.LAST_UPDATE_DATE_FORMAT).encode()
+        self.__mode = mode
+        self.__max_size = max_size
+        self.__records = None
+
+    def __getstate__(self):
+        """Only the location of the cache is passed to other processes, which map the file again."""
+        return self.__path, self.__date, self.__mode, self.__max_size
+
+    def __setstate__(self, state):
+        self.__path, self.__date, self.__mode, self.__max_size = state
+        self.__records = None
+
+    def _load(self):
+        """Maps the file the cache is stored in, and indexes its records.
+        A record only partially written at the end of the file (e.g. by another process appending to it) is ignored."""
+        self.__records = np.empty(0, dtype=RECORD_DTYPE)
+        self.__appended = {}
+        try:
+            with open(self.__path, "rb") as f:
+                count = os.fstat(f.fileno()).st_size // RECORD_DTYPE.itemsize
+                if count > 0:
+                    mapping = mmap.mmap(f.fileno(), count * RECORD_DTYPE.itemsize, access=mmap.ACCESS_READ)
+                    self.__records = np.frombuffer(mapping, dtype=RECORD_DTYPE)
+        except FileNotFoundError:
+            pass
+
+        heads = _key_heads(self.__records['key'])
+        self.__order = np.argsort(heads, kind='stable')
+        self.__heads = heads[self.__order]
+
+    def _key(self, sk, iv):
+        """:returns the key of the record containing the EphIDs produced by :param sk with :param iv,
+            hashed as crhf.H does"""
+        return sha256(self.__date + bytes([self.__mode]) + sk + iv).digest()
+
+    def _lookup(self, keys):
+        """Finds the records stored in the file with the given keys.
+        :param keys: a NumPy array of bytes of shape (number of keys, CACHE_KEY_SIZE)
+        :returns a NumPy array of the positions of the records with :param keys, -1 for each key not found"""
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        if not len(self.__heads):
+            return positions
+
+        heads = _key_heads(keys)
+        first = np.searchsorted(self.__heads, heads, side='left')
+        last = np.searchsorted(self.__heads, heads, side='right')
+
+        # Almost always a single record has the same first bytes of a key, and it is compared with the whole key
+        single = np.nonzero(last - first == 1)[0]
+        records = self.__order[first[single]]
+        equal = (self.__records['key'][records] == keys[single]).all(axis=1)
+        positions[single[equal]] = records[equal]
+
+        # Unless the first bytes of two distinct keys collide
+        for k in np.nonzero(last - first > 1)[0]:
+            for record in self.__order[first[k]:last[k]]:
+                if np.array_equal(self.__records['key'][record], keys[k]):
+                    positions[k] = record
+                    break
+        return positions
+
+    def _append(self, records):
+        """Appends many records to the file, as long as its maximum size is not exceeded.
+        Where file locking is available, the processes appending to the same file take turns,
+        so that a record only partially written at the end of the file can only be left by a crash, and is overwritten.
+        :param records: a NumPy array of RECORD_DTYPE
+        :returns the number of records appended, the first ones of :param records"""
+        with open(self.__path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            if fcntl is not None and not size % RECORD_DTYPE.itemsize == 0:
+                size -= size % RECORD_DTYPE.itemsize
+                f.truncate(size)
+            count = min(len(records), max(self.__max_size - size, 0) // RECORD_DTYPE.itemsize)
+            f.write(records[:count].tobytes())
+        return count
+
+    def get(self, sk_list, iv):
+        """Returns the EphIDs produced by many SKs with the same IV, as batch_generate_ephids does.
+        Only the EphIDs not found in the cache are generated, and they are appended to the file (see _append).
+        :param sk_list: a list of the bytes sequences representing the SKs
+        :param iv: the bytes sequence representing the IV
+        :return ephids: a NumPy array of bytes of shape (len(sk_list), N, EPHID_SIZE),
+            such that ephids[i, j] is the EphID of the j-th slot of the day produced by the i-th SK"""
+        if self.__records is None:
+            self._load()
+
+        keys = np.frombuffer(b''.join(self._key(sk, iv) for sk in sk_list), dtype=np.uint8)
+        keys = keys.reshape(len(sk_list), CACHE_KEY_SIZE)
+        positions = self._lookup(keys)
+
+        ephids = np.empty((len(sk_list), N, EPHID_SIZE), dtype=np.uint8)
+        found = np.nonzero(positions >= 0)[0]
+        ephids[found] = self.__records['ephids'][positions[found]]
+
+        missing = []
+        for i in np.nonzero(positions < 0)[0]:
+            appended = self.__appended.get(keys[i].tobytes())
+            if appended is None:
+                missing.append(i)
+            else:
+                ephids[i] = appended
+
+        if missing:
+            records = np.empty(len(missing), dtype=RECORD_DTYPE)
+            records['key'] = keys[missing]
+            records['ephids'] = batch_generate_ephids([sk_list[i] for i in missing], iv, self.__mode)
+            ephids[missing] = records['ephids']
+            for record in records[:self._append(records)]:
+                self.__appended[record['key'].tobytes()] = record['ephids']
+
+        return ephids
+
+    def _filter_path(self, sk_list, iv, fp_rate):
+        """:returns the file the Bloom filter of the EphIDs produced by :param sk_list with :param iv is stored in"""
+        sks = sha256(b''.join(sk_list)).digest()
+        key = sha256(self.__date + bytes([self.__mode]) + iv + str(fp_rate).encode() + sks).hexdigest()
+        return os.path.join(self.__path + FILTERS_DIR_SUFFIX, key)
+
+    def get_filter(self, sk_list, iv, fp_rate):
+        """Reads the Bloom filter of the EphIDs produced by many SKs with the same IV.
+        :param sk_list: a list of the bytes sequences representing the SKs
+        :param iv: the bytes sequence representing the IV
+        :param fp_rate: the false positive rate of the filter
+        :returns the BloomFilter object stored by put_filter, or None if it has not been stored (or it is malformed)"""
+        try:
+            with open(self._filter_path(sk_list, iv, fp_rate), "rb") as f:
+                return BloomFilter.from_bytes(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_filter(self, sk_list, iv, fp_rate, bloom_filter):
+        """Stores the Bloom filter of the EphIDs produced by many SKs with the same IV,
+        unless the directory of the filters would exceed the maximum size of the cache.
+        The filter replaces the old one at once (see write_atomically).
+        :param sk_list: a list of the bytes sequences representing the SKs
+        :param iv: the bytes sequence representing the IV
+        :param fp_rate: the false positive rate of the filter
+        :param bloom_filter: the BloomFilter object containing all the EphIDs produced by :param sk_list
+            with :param iv"""
+        path = self._filter_path(sk_list, iv, fp_rate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = bloom_filter.to_bytes()
+        with os.scandir(os.path.dirname(path)) as entries:
+            if sum(entry.stat().st_size for entry in entries) + len(data) > self.__max_size:
+                return
+
+        write_atomically(path, data)
+
+    @staticmethod
+    def invalidate(path):
+        """Deletes the file a cache is stored in, together with its Bloom filters,
+        e.g. because the SKs of the infected users have been updated.
+        :param path: the file the cache is stored in"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(path + FILTERS_DIR_SUFFIX, ignore_errors=True)
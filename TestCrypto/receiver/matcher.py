@@ -0,0 +1,274 @@
+"""
+This module contains the methods to check which of the received EphIDs can be generated by the infected users.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cipher import batch_generate_ephids
+from definitions import IV_SIZE, EPHID_SIZE
+from parameters import N
+
+from receiver.bloom_filter import BloomFilter
+
+
+# Number of SKs whose EphIDs are generated together in a single array
+BATCH_SIZE = 4096
+
+
+def as_blocks(sequence, size):
+    """Returns the received IVs or EphIDs as a two-dimensional NumPy array of bytes.
+    :param sequence: a list of bytes sequences of length :param size,
+        or a NumPy array of bytes of shape (number of packets, :param size), which is returned as it is
+    :param size: the size in bytes of each element of :param sequence
+    :returns a NumPy array of bytes of shape (len(sequence), :param size)"""
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    return np.frombuffer(b''.join(sequence), dtype=np.uint8).reshape(len(sequence), size)
+
+
+def index_packets(ivs):
+    """Groups the received packets by the IV they have been received with.
+    :param ivs: a NumPy array of bytes of shape (number of packets, IV_SIZE) containing the received IVs
+    :return index: a dictionary mapping each distinct IV to a NumPy array of the positions of the packets carrying it"""
+    if not len(ivs):
+        return {}
+
+    distinct_ivs, inverse = np.unique(ivs, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    positions = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+    return {iv.tobytes(): iv_positions for (iv, iv_positions) in zip(distinct_ivs, positions)}
+
+
+def _generate_ephids(sk_list, iv, cache):
+    """Produces the EphIDs of many SKs with the same IV, reading them from the cache if one is given.
+    :returns a NumPy array of bytes, as returned by batch_generate_ephids"""
+    if cache is None:
+        return batch_generate_ephids(sk_list, iv)
+    return cache.get(sk_list, iv)
+
+
+def _screen(sk_list, iv, positions, received, cache, fp_rate):
+    """Screens the EphIDs received with an IV with the Bloom filter of the EphIDs produced by the SKs with it,
+    stored in the cache: the EphIDs that do not pass the screening surely do not match any SK.
+    If the filter has not been stored yet, no EphID is screened, and an empty filter is returned,
+    to add the EphIDs of the SKs to while they are matched and then to store it.
+    :param sk_list: a list of the SKs of the infected users
+    :param iv: the bytes sequence representing the IV
+    :param positions: a NumPy array of the positions of the packets received with :param iv
+    :param received: a NumPy array of bytes containing the EphIDs of the packets in :param positions
+    :param cache: the EphIDCache the filter is stored in, or None
+    :param fp_rate: the false positive rate of the filter, or None if the EphIDs are not screened
+    :return positions: the positions of the packets that pass the screening
+    :return received: the EphIDs of the packets that pass the screening
+    :return bloom_filter: the empty BloomFilter object to build, or None if it has already been stored"""
+    if fp_rate is None or cache is None:
+        return positions, received, None
+
+    bloom_filter = cache.get_filter(sk_list, iv, fp_rate)
+    if bloom_filter is None:
+        return positions, received, BloomFilter(len(sk_list) * N, fp_rate)
+
+    passed = bloom_filter.contains(received)
+    return positions[passed], received[passed], None
+
+
+def match_packets(sk_list, iv_list, ephid_list, slot_list=None, tolerance=0, cache=None, fp_rate=None):
+    """Finds the received packets whose EphID can be generated by one of the SKs.
+    The EphIDs of each SK are generated only once for each distinct IV, in batches of BATCH_SIZE SKs,
+    and each of them is looked up among the EphIDs received with that IV.
+    If the slots of the day the packets have been received in are known, see match_packets_in_slots.
+    If a cache and a false positive rate are given, the EphIDs received with each IV are screened first
+    with the Bloom filter of the EphIDs the SKs produce with it (see _screen): once the filter is stored,
+    the EphIDs of the SKs are produced only for the IVs some received EphIDs pass the screening of.
+    :param sk_list: a list of the SKs of the infected users
+    :param iv_list: the received IVs, as a list of bytes sequences or as a NumPy array of bytes (see as_blocks)
+    :param ephid_list: the received EphIDs, as a list of bytes sequences or as a NumPy array of bytes (see as_blocks)
+    :param slot_list: (Optional) a list of the slots of the day the packets have been received in
+    :param tolerance: (Optional) how many slots before and after the slot of reception an EphID is searched in
+    :param cache: (Optional) the EphIDCache the EphIDs of the SKs are read from; if not specified, no cache is used
+    :param fp_rate: (Optional) the false positive rate of the filters the packets are screened with;
+        if not specified, or if no cache is used, the packets are not screened
+    :return matches: a sorted list of couples (i, j), meaning that the SK in position i of :param sk_list
+        can generate the EphID of the packet in position j"""
+    ivs = as_blocks(iv_list, IV_SIZE)
+    ephids = as_blocks(ephid_list, EPHID_SIZE)
+
+    if slot_list is not None:
+        return match_packets_in_slots(sk_list, ivs, ephids, slot_list, tolerance, cache, fp_rate)
+
+    matches = []
+    for iv, positions in index_packets(ivs).items():
+        positions, received, bloom_filter = _screen(sk_list, iv, positions, ephids[positions], cache, fp_rate)
+        if not len(positions):
+            continue
+
+        # The first 8 bytes of the received EphIDs, compared as integers to quickly discard most of the candidates
+        received_heads = received.view(np.uint64)[:, 0]
+        for offset in range(0, len(sk_list), BATCH_SIZE):
+            generated = _generate_ephids(sk_list[offset:offset + BATCH_SIZE], iv, cache)
+            if bloom_filter is not None:
+                bloom_filter.add(generated)
+            candidates = np.isin(generated.view(np.uint64)[..., 0], received_heads)
+            for (i, slot) in zip(*np.nonzero(candidates)):
+                for k in np.nonzero((received == generated[i, slot]).all(axis=1))[0]:
+                    matches.append((offset + int(i), int(positions[k])))
+
+        if bloom_filter is not None:
+            cache.put_filter(sk_list, iv, fp_rate, bloom_filter)
+
+    matches.sort()
+    return matches
+
+
+def match_packets_in_slots(sk_list, iv_list, ephid_list, slot_list, tolerance=0, cache=None, fp_rate=None):
+    """Finds the received packets whose EphID can be generated by one of the SKs,
+    knowing the slot of the day each packet has been received in.
+    The EphIDs of each SK are generated only once for each distinct IV, in batches of BATCH_SIZE SKs,
+    and each received EphID is compared only with the EphIDs of the slots close to the one it has been received in.
+    The encryption of the Broadcast Key stops at the last slot to check for the packets received with each IV,
+    unless a cache is used: then the whole EphIDs of each SK are read from it (or generated and stored in it),
+    and the received EphIDs can be screened as match_packets does.
+    :param sk_list: a list of the SKs of the infected users
+    :param iv_list: the received IVs (see as_blocks)
+    :param ephid_list: the received EphIDs (see as_blocks)
+    :param slot_list: a list of the slots of the day the packets have been received in
+    :param tolerance: (Optional) how many slots before and after the slot of reception an EphID is searched in
+    :param cache: (Optional) the EphIDCache the EphIDs of the SKs are read from; if not specified, no cache is used
+    :param fp_rate: (Optional) the false positive rate of the filters the packets are screened with (see match_packets)
+    :return matches: a sorted list of couples (i, j), meaning that the SK in position i of :param sk_list
+        can generate the EphID of the packet in position j"""
+    ephids = as_blocks(ephid_list, EPHID_SIZE)
+    slots = np.asarray(slot_list, dtype=np.int64)
+
+    matches = []
+    for iv, positions in index_packets(as_blocks(iv_list, IV_SIZE)).items():
+        positions, received, bloom_filter = _screen(sk_list, iv, positions, ephids[positions], cache, fp_rate)
+        if not len(positions):
+            continue
+
+        # The first and the last slot whose EphIDs are compared with each received EphID
+        first_slots = np.maximum(slots[positions] - tolerance, 0)
+        last_slots = np.minimum(slots[positions] + tolerance, N - 1)
+
+        for offset in range(0, len(sk_list), BATCH_SIZE):
+            batch = sk_list[offset:offset + BATCH_SIZE]
+            if cache is None:
+                generated = batch_generate_ephids(batch, iv, slots=int(last_slots.max()) + 1)
+            else:
+                generated = cache.get(batch, iv)
+                if bloom_filter is not None:
+                    bloom_filter.add(generated)
+
+            # The first 8 bytes of the EphIDs, compared as integers to quickly discard most of the candidates
+            generated_heads = generated.view(np.uint64)[..., 0]
+            for (j, ephid, first, last) in zip(positions, received, first_slots, last_slots):
+                for (i, slot) in zip(*np.nonzero(generated_heads[:, first:last + 1] == ephid.view(np.uint64)[0])):
+                    if np.array_equal(generated[i, first + slot], ephid):
+                        matches.append((offset + int(i), int(j)))
+
+        if bloom_filter is not None:
+            cache.put_filter(sk_list, iv, fp_rate, bloom_filter)
+
+    matches.sort()
+    return matches
+
+
+# The EphIDCache of a worker process, set once when the process starts (see create_executor)
+_worker_cache = None
+
+
+def _init_worker(cache):
+    """Sets the EphIDCache the worker process reads the EphIDs of the SKs from, so that it is mapped only once."""
+    global _worker_cache
+    _worker_cache = cache
+
+
+def create_executor(workers, cache=None):
+    """Creates the pool of worker processes matching the shards of the SKs of the infected users.
+    The same pool can be used for many calls of match_packets_parallel, so that each process maps the cache only once.
+    :param workers: the number of worker processes
+    :param cache: (Optional) the EphIDCache the EphIDs of the SKs are read from; if not specified, no cache is used
+    :returns a ProcessPoolExecutor object"""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache,))
+
+
+def _match_shard(offset, sk_list, iv_list, ephid_list, slot_list, tolerance, fp_rate):
+    """Matches the received packets against a shard of the SKs of the infected users, in a worker process.
+    :param offset: the position of the first SK of the shard in the whole list of SKs
+    :returns the matches of the shard, as returned by match_packets, with the positions of the SKs in the whole list"""
+    matches = match_packets(sk_list, iv_list, ephid_list, slot_list, tolerance, _worker_cache, fp_rate)
+    return [(offset + i, j) for (i, j) in matches]
+
+
+def match_packets_parallel(sk_list, iv_list, ephid_list, workers, slot_list=None, tolerance=0, cache=None,
+                           fp_rate=None, executor=None):
+    """Finds the received packets whose EphID can be generated by one of the SKs, as match_packets does,
+    splitting the SKs of the infected users in shards matched by a pool of worker processes.
+    :param sk_list: a list of the SKs of the infected users
+    :param iv_list: a list of the received IVs
+    :param ephid_list: a list of the received EphIDs
+    :param workers: the number of worker processes
+    :param slot_list: (Optional) a list of the slots of the day the packets have been received in
+    :param tolerance: (Optional) how many slots before and after the slot of reception an EphID is searched in
+    :param cache: (Optional) the EphIDCache the EphIDs of the SKs are read from; if not specified, no cache is used
+    :param fp_rate: (Optional) the false positive rate of the filters each shard screens the packets with;
+        if not specified, or if no cache is used, the packets are not screened
+    :param executor: (Optional) the pool of :param workers worker processes, as returned by create_executor
+        with :param cache; if not specified, a new one is created
+    :return matches: a sorted list of couples (i, j), as returned by match_packets"""
+    if workers <= 1 or len(sk_list) <= 1:
+        return match_packets(sk_list, iv_list, ephid_list, slot_list, tolerance, cache, fp_rate)
+
+    if executor is None:
+        with create_executor(workers, cache) as executor:
+            return match_packets_parallel(sk_list, iv_list, ephid_list, workers, slot_list, tolerance, cache,
+                                          fp_rate, executor)
+
+    shard_size = -(-len(sk_list) // min(workers, len(sk_list)))
+    futures = [executor.submit(_match_shard, offset, sk_list[offset:offset + shard_size],
+                               iv_list, ephid_list, slot_list, tolerance, fp_rate)
+               for offset in range(0, len(sk_list), shard_size)]
+    matches = [match for future in futures for match in future.result()]
+
+    matches.sort()
+    return matches
+
+
+def match_new_packets(sk_list, iv_list, ephid_list, workers, old_sks, old_packets, slot_list=None, tolerance=0,
+                      cache=None, fp_rate=None, executor=None):
+    """Finds the received packets whose EphID can be generated by one of the SKs, as match_packets_parallel does,
+    knowing that the first SKs have already been matched against the first packets.
+    Only the new packets are matched against all the SKs, and only the new SKs are matched against the old packets,
+    so that the cost is proportional to what is new, not to all the SKs and packets stored.
+    :param sk_list: a list of the SKs of the infected users
+    :param iv_list: a list of the received IVs
+    :param ephid_list: a list of the received EphIDs
+    :param workers: the number of worker processes
+    :param old_sks: the number of SKs, at the beginning of :param sk_list, already matched
+    :param old_packets: the number of packets, at the beginning of :param iv_list, already matched
+    :param slot_list: (Optional) a list of the slots of the day the packets have been received in
+    :param tolerance: (Optional) how many slots before and after the slot of reception an EphID is searched in
+    :param cache: (Optional) the EphIDCache the EphIDs of the SKs are read from; if not specified, no cache is used
+    :param fp_rate: (Optional) the false positive rate of the filters the packets are screened with;
+        if not specified, or if no cache is used, the packets are not screened
+    :param executor: (Optional) the pool of worker processes (see match_packets_parallel)
+    :return matches: a sorted list of the couples (i, j), as returned by match_packets,
+        such that the SK in position i or the packet in position j is new"""
+    matches = []
+
+    if old_packets < len(ephid_list):
+        new_slots = None if slot_list is None else slot_list[old_packets:]
+        new = match_packets_parallel(sk_list, iv_list[old_packets:], ephid_list[old_packets:], workers,
+                                     new_slots, tolerance, cache, fp_rate, executor)
+        matches.extend((i, old_packets + j) for (i, j) in new)
+
+    if old_sks < len(sk_list) and old_packets > 0:
+        old_slots = None if slot_list is None else slot_list[:old_packets]
+        new = match_packets_parallel(sk_list[old_sks:], iv_list[:old_packets], ephid_list[:old_packets], workers,
+                                     old_slots, tolerance, cache, fp_rate, executor)
+        matches.extend((old_sks + i, j) for (i, j) in new)
+
+    matches.sort()
+    return matches
@@ -0,0 +1,88 @@
+"""
+This module contains the methods to store the received packets, partitioned in a file for each day.
+Each packet is stored with the slot of the day it has been received in.
+"""
+
+from datetime import datetime, timedelta
+import os
+
+from definitions import PACKET_SIZE
+from key_generator import Key
+from parameters import L
+from receiver.rec_definitions import PACKETS_DIR, PACKETS_FILE_EXTENSION, RETENTION_DAYS, SLOT_SIZE
+
+from utils import append_if_absent, get_current_minutes, map_records
+
+
+# Size in bytes of a stored packet (packet + slot of reception)
+RECORD_SIZE = PACKET_SIZE + SLOT_SIZE
+
+
+def packets_file(day, directory=PACKETS_DIR):
+    """:returns the file the packets received in :param day are stored in, inside :param directory"""
+    return os.path.join(directory, day.strftime(Key.LAST_UPDATE_DATE_FORMAT) + PACKETS_FILE_EXTENSION)
+
+
+def store_packet(packet, directory=PACKETS_DIR, day=None, slot=None):
+    """Appends a received packet, followed by the slot of the day it has been received in,
+    at the end of the file of the day, if it is not already present in it.
+    If the directory or the file don't exist, they are created.
+    :param packet: the bytes sequence representing the packet
+    :param directory: (Optional) the directory the files containing the packets are stored in
+    :param day: (Optional) a datetime object representing the day the packet has been received in;
+        if not specified, the current date is used
+    :param slot: (Optional) the slot of the day the packet has been received in (i.e., minutes from midnight // L);
+        if not specified, the current slot is used"""
+    if slot is None:
+        slot = get_current_minutes() // L
+
+    os.makedirs(directory, exist_ok=True)
+    record = packet + slot.to_bytes(SLOT_SIZE, 'big')
+    append_if_absent(record, RECORD_SIZE, packets_file(day or datetime.now(), directory))
+
+
+def stored_days(directory=PACKETS_DIR):
+    """Finds the days some packets have been received in.
+    :param directory: (Optional) the directory the files containing the packets are stored in
+    :return days: a sorted list of datetime objects, one for each file containing packets"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    days = []
+    for name in names:
+        date, extension = os.path.splitext(name)
+        if not extension == PACKETS_FILE_EXTENSION:
+            continue
+        try:
+            days.append(datetime.strptime(date, Key.LAST_UPDATE_DATE_FORMAT))
+        except ValueError:
+            continue
+    return sorted(days)
+
+
+def prune_packets(retention_days=RETENTION_DAYS, directory=PACKETS_DIR):
+    """Deletes the files containing the packets received before the retention window.
+    :param retention_days: (Optional) the number of days the packets are kept for, including the current day
+    :param directory: (Optional) the directory the files containing the packets are stored in
+    :return days: a list of datetime objects representing the days whose packets have been deleted"""
+    now = datetime.now()
+    first_day = datetime(now.year, now.month, now.day) - timedelta(days=retention_days - 1)
+
+    days = [day for day in stored_days(directory) if day < first_day]
+    for day in days:
+        os.remove(packets_file(day, directory))
+    return days
+
+
+def read_packets_of_day(day, directory=PACKETS_DIR):
+    """Memory maps the file containing the packets received in a day (see utils.map_records).
+    :param day: a datetime object representing the day
+    :param directory: (Optional) the directory the files containing the packets are stored in
+    :raises FileNotFoundError if no packet has been received in :param day
+    :raises ValueError if the content of the file is not compatible with the size of the stored packets
+    :return packets: a NumPy array of bytes of shape (number of packets, PACKET_SIZE)
+    :return slots: a NumPy array of integers containing the slot of the day each packet has been received in"""
+    records = map_records(packets_file(day, directory), RECORD_SIZE)
+    return records[:, :PACKET_SIZE], records[:, PACKET_SIZE:].view(f'>u{SLOT_SIZE}').reshape(-1)
@@ -18,5 +18,38 @@ SK_INFECTED_FILE = "sk_infected.pem"
 # File the date of the last update of the SK of the infected users is stored in
 LAST_SK_INFECTED_UPDATE_FILE = "last_sk_infected_update.txt"
 
-# File the received EphIDs with proper signatures are saved in
-EPHID_AND_SIGNATURE_FILE = "ephids.pem"
+# File the first SK received of each infected user is stored in, followed by the day it is valid in,
+# so that the SKs of the previous days can be derived from it
+SK_INFECTED_ORIGIN_FILE = "sk_infected_origin.pem"
+
+# File the checkpoints of the hash chains of the SKs of the infected users are stored in
+SK_CHAIN_TABLE_FILE = "sk_chain_table.bin"
+
+# Directory the received EphIDs with proper signatures are saved in, in a file for each day
+PACKETS_DIR = "packets"
+
+# Extension of the file the EphIDs received in a day are saved in (e.g. 2020-06-01.pem)
+PACKETS_FILE_EXTENSION = ".pem"
+
+# Number of days the received EphIDs are kept for (including the current day)
+RETENTION_DAYS = 14
+
+# Size in bytes of the slot of the day a packet has been received in, stored after the packet
+SLOT_SIZE = 2
+
+# Number of slots before and after the slot of reception a received EphID is searched in,
+# to tolerate clock differences between the sender and the receiver
+SLOT_TOLERANCE = 1
+
+# File the EphIDs produced by the SKs of the infected users are cached in
+EPHID_CACHE_FILE = "ephids_cache.bin"
+
+# Maximum size in bytes of the file the EphIDs are cached in, and of the directory of their Bloom filters
+# (each record of the cache takes about 2.3 KB, so about 110000 records fit in it)
+EPHID_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# File the number of SKs and packets already matched is stored in, so that each run only matches the new ones
+MATCH_CHECKPOINT_FILE = "match_checkpoint.txt"
+
+# False positive rate of the filter the received EphIDs are screened with before being matched
+BLOOM_FALSE_POSITIVE_RATE = 0.001
@@ -8,38 +8,109 @@ import sys
 
 sys.path.append('../')
 
-import os
+import argparse
+from bisect import bisect_left
+from contextlib import nullcontext
 from datetime import datetime
 
 from secrets import token_bytes
 
-from cipher import Encryptor
-from crhf import H
-from definitions import PACKET_SIZE, IV_SIZE, EPHID_SIZE, SIGNATURE_SIZE
-from key_generator import PUBLIC_KEY_SIZE, PublicSK, SK_SIZE, Key
-from parameters import N
+from crhf import H_chains
+from definitions import IV_SIZE, EPHID_SIZE, SIGNATURE_SIZE
+from key_generator import PUBLIC_KEY_SIZE, PublicSK, SK_SIZE, SK_CHAIN_TABLE_SIZE, Key, SKChainTable
+from receiver.checkpoint import MatchCheckpoint
 from receiver.client import send_data_to_server
+from receiver.ephid_cache import EphIDCache
+from receiver.matcher import create_executor, match_new_packets
+from receiver.packet_store import prune_packets, read_packets_of_day, stored_days
 from receiver.rec_definitions import (PUBLIC_KEY_INFECTED_FILE, SK_INFECTED_FILE, LAST_SK_INFECTED_UPDATE_FILE,
-                                      EPHID_AND_SIGNATURE_FILE)
+                                      SK_INFECTED_ORIGIN_FILE, SK_CHAIN_TABLE_FILE, EPHID_CACHE_FILE,
+                                      EPHID_CACHE_MAX_SIZE, BLOOM_FALSE_POSITIVE_RATE, SLOT_TOLERANCE,
+                                      MATCH_CHECKPOINT_FILE)
 from signatures import Verifier
 
-from utils import split_sequence, split_in_chunks
+from utils import split_in_chunks, write_atomically
 
 
-def read_keys():
+# Size in bytes of a date, as stored after each SK in the file of the first SKs of the infected users
+DATE_SIZE = len(datetime.now().strftime(Key.LAST_UPDATE_DATE_FORMAT))
+
+
+def read_origins(sk_list, last_update):
+    """Gets the first SK received of each infected user, together with the day it is valid in,
+    reading them from the proper file.
+    The SKs of the infected users not in the file yet are valid in the day of the last update of the SKs,
+    and they are appended to it. If the file does not match the SKs (e.g. it has been partially written),
+    it is written again from scratch.
+    :param sk_list: a list of the SKs of all infected users, not updated since :param last_update
+    :param last_update: a datetime object representing the day the SKs in :param sk_list are valid in
+    :return origin_list: a list of couples (SK, datetime object), one for each infected user,
+        containing the first SK received of the user and the day it is valid in"""
+    record_size = SK_SIZE + DATE_SIZE
+    try:
+        with open(SK_INFECTED_ORIGIN_FILE, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b''
+
+    origin_list = []
+    if len(data) % record_size == 0 and len(data) // record_size <= len(sk_list):
+        for start in range(0, len(data), record_size):
+            day = data[start + SK_SIZE:start + record_size].decode()
+            origin_list.append((data[start:start + SK_SIZE], datetime.strptime(day, Key.LAST_UPDATE_DATE_FORMAT)))
+        mode = "ab"
+    else:
+        mode = "wb"
+
+    new_origins = [(sk, last_update) for sk in sk_list[len(origin_list):]]
+    if new_origins:
+        with open(SK_INFECTED_ORIGIN_FILE, mode) as f:
+            f.write(b''.join(sk + day.strftime(Key.LAST_UPDATE_DATE_FORMAT).encode() for (sk, day) in new_origins))
+        origin_list.extend(new_origins)
+
+    return origin_list
+
+
+def derive_current_sks(origin_list, workers=1):
+    """Derives the SKs the infected users use in the current day from the first SK received of each of them,
+    i.e. H applied once for each day passed since the day the first SK is valid in.
+    The SKs whose first SK is valid in the same day are hashed all at once (see H_chains).
+    :param origin_list: a list of the first SKs received of all infected users, as returned by read_origins
+    :param workers: (Optional) the number of processes the SKs are hashed by
+    :return sk_list: a list of the SKs of the current day of all infected users"""
+    users_of_day = {}
+    for (i, (sk, origin)) in enumerate(origin_list):
+        users_of_day.setdefault(origin.date(), []).append(i)
+
+    sk_list = [b''] * len(origin_list)
+    for (origin, users) in users_of_day.items():
+        days = (datetime.now().date() - origin).days
+        for (i, sk) in zip(users, H_chains([origin_list[i][0] for i in users], days, workers)):
+            sk_list[i] = sk
+    return sk_list
+
+
+def read_keys(workers=1):
     """Gets the Public keys and the SKs of the infected users, reading them from the proper files.
-    Then, all stored SKs will be updated depending on the date of the last update and the current date.
+    The first SK received of each infected user is recorded (see read_origins).
+    Then, if the date of the last update is not the current one, all stored SKs will be derived again from the first
+    ones (see derive_current_sks), and the cache of the EphIDs they produced will be invalidated.
+    Since the SKs are not hashed starting from the stored ones, a crash before the date of the update is written
+    only makes the next run derive the same SKs again.
+    The updated SKs replace the old ones at once (see write_atomically).
     If the file containing the date of the last update of the SKs of the infected users doens't exist,
     a new one will be created, containing the current date.
     If the file containing the public keys of the infected users doesn't exist,
     it means that there are no infected users in the system, thus the algorithm ends.
+    :param workers: (Optional) the number of processes the SKs are updated by
     :raises ValueError if:
         the content of the file containing the public keys of the infected users is not compatible
             with the size of the public key
         the content of the file containing the SKs of the infected users is not compatible with the size of SK in bytes
         the number of public keys and SKs read are different
     :return public_key_list: a list of the public keys of all infected users
-    :return sk_list: a list of the properly updated SKs of all infected users"""
+    :return sk_list: a list of the properly updated SKs of all infected users
+    :return origin_list: a list of the first SKs received of all infected users, as returned by read_origins"""
     try:
         with open(LAST_SK_INFECTED_UPDATE_FILE, "r") as f:
             last_update = datetime.strptime(f.read(), Key.LAST_UPDATE_DATE_FORMAT)
@@ -56,7 +127,7 @@ def read_keys():
         public_key_list = split_in_chunks(public_key_list, PUBLIC_KEY_SIZE)
     except FileNotFoundError:
         print('No Public Keys in the database.')
-        return [], []
+        return [], [], []
 
     try:
         with open(SK_INFECTED_FILE, "rb") as f:
@@ -70,111 +141,175 @@ def read_keys():
     if not len(public_key_list) == len(sk_list):
         raise ValueError(f'Files {PUBLIC_KEY_INFECTED_FILE} and {SK_INFECTED_FILE} contain different number of keys')
 
+    origin_list = read_origins(sk_list, last_update)
+
     days = (datetime.now() - last_update).days
 
     if not days > 0:
-        return public_key_list, sk_list
+        return public_key_list, sk_list, origin_list
+
+    # SK = H(first SK) for each day passed since the day of the first SK
+    sk_list = derive_current_sks(origin_list, workers)
 
-    for sk in sk_list:
-        for _ in range(days):
-            sk = H(sk)
+    write_atomically(SK_INFECTED_FILE, b''.join(sk_list))
 
-        with open(os.path.join(SK_INFECTED_FILE), "wb") as f:
-            f.write(sk)
+    EphIDCache.invalidate(EPHID_CACHE_FILE)
 
-    with open(os.path.join(LAST_SK_INFECTED_UPDATE_FILE), "w") as f:
+    with open(LAST_SK_INFECTED_UPDATE_FILE, "w") as f:
         f.write(datetime.now().strftime(Key.LAST_UPDATE_DATE_FORMAT))
 
-    return public_key_list, sk_list
+    return public_key_list, sk_list, origin_list
 
 
-def read_packets():
-    """Gets the BLE packets received by the other users, reading them from the proper file,
-    and splits them into IV, EphID and signature.
-    If the file containing the packets k doesn't exist,
-    it means that the user has not received any packet, thus the algorithm ends.
-    :raises ValueError if the content of the file containing the packets is not compatible with the packet size
-    :return iv_list: a list of the IVS to check if one of the infected users can generate one of the received EphIDs
-    :return ephid_list: a list of the received EphIDs
-    :return tag_list: a list of the received signatures"""
-    try:
-        with open(EPHID_AND_SIGNATURE_FILE, "rb") as f:
-            ciphertext = f.read()
-    except FileNotFoundError:
-        print('No EphIDs received yet.')
-        return [], [], []
+def sks_of_day(day, sk_list, origin_list, sk_chains):
+    """Gets the SKs the infected users have used in a day.
+    The SKs of the current day are the updated ones, while the SKs of a previous day are derived from the first SK
+    received of each infected user, skipping the users whose first SK received is valid in a later day.
+    :param day: a datetime object representing the day
+    :param sk_list: a list of the updated SKs of all infected users
+    :param origin_list: a list of the first SKs received of all infected users, as returned by read_origins
+    :param sk_chains: the SKChainTable object the SKs are derived with
+    :return users: a sorted list of the positions of the infected users the SKs belong to
+    :return day_sk_list: a list of the SKs of the infected users in :param users, valid in :param day"""
+    if day.date() == datetime.now().date():
+        return list(range(len(sk_list))), sk_list
 
-    if not len(ciphertext) % PACKET_SIZE == 0:
-        raise ValueError('ciphertext size not valid')
+    users = [i for (i, (sk, origin)) in enumerate(origin_list) if origin.date() <= day.date()]
+    return users, [sk_chains.derive_sk(origin_list[i][0], origin_list[i][1], day) for i in users]
 
-    packets = split_in_chunks(ciphertext, PACKET_SIZE)
 
-    iv_list = []
-    ephid_list = []
-    tag_list = []
+def read_packets(day):
+    """Gets the BLE packets received by the other users in a day, reading them from the proper file,
+    and splits them into IV, EphID and signature, together with the slot of the day they have been received in.
+    The file is memory mapped, and the IVs, the EphIDs and the signatures are views of it: no packet is copied.
+    :param day: a datetime object representing the day the packets have been received in
+    :raises ValueError if the content of the file containing the packets is not compatible with the packet size
+    :return iv_list: a NumPy array of bytes of shape (number of packets, IV_SIZE) containing the IVS to check
+        if one of the infected users can generate one of the received EphIDs
+    :return ephid_list: a NumPy array of bytes of shape (number of packets, EPHID_SIZE) containing the received EphIDs
+    :return tag_list: a NumPy array of bytes of shape (number of packets, SIGNATURE_SIZE)
+        containing the received signatures
+    :return slot_list: a NumPy array of integers containing the slots of the day the packets have been received in"""
+    try:
+        packets, slot_list = read_packets_of_day(day)
+    except ValueError:
+        raise ValueError('ciphertext size not valid')
 
-    for packet in packets:
-        iv = packet[:IV_SIZE]
-        ephid = packet[IV_SIZE:IV_SIZE + EPHID_SIZE]
-        tag = packet[-SIGNATURE_SIZE:]
-        iv_list.append(iv)
-        ephid_list.append(ephid)
-        tag_list.append(tag)
+    iv_list = packets[:, :IV_SIZE]
+    ephid_list = packets[:, IV_SIZE:IV_SIZE + EPHID_SIZE]
+    tag_list = packets[:, -SIGNATURE_SIZE:]
 
-    return iv_list, ephid_list, tag_list
+    return iv_list, ephid_list, tag_list, slot_list
 
 
-def verify(sk, ephid, tag):
+def verify_many(reports):
     """
-    This function verifies that the signature tag is valid and corresponds to the signature of the EphID generated using
-    the private key of an infected person. The verification process needs the public key.
-    Since the signature algorithm uses elliptic curves, we only need two
-    paramters, x and y, to reconstruct the public key of the infected person.
-    The type of curve is defined by the protocol.
-    :param sk: public key used to verify
-    :param ephid: the original ephid transmitted by the non infected person
-    :param tag: the signature of the ephid to be verified
+    This function verifies that the signature tags of many reports are valid and correspond to the signatures of
+    the EphIDs generated using the private keys of infected people.
+    Identical reports are verified only once, and the public key of each infected person is reconstructed only once,
+    then the same verifier is used for all the reports containing it.
+    :param reports: a list of triples (public key, ephid, tag) to verify
+    :return results: a dictionary mapping each distinct report to True if its signature is valid, False otherwise
     """
-    pk = PublicSK.construct_public_key(sk)
-    verifier = Verifier(pk)
-    signature_valid = verifier.verify(ephid, tag)
-    return signature_valid
-
-
-def main(is_adv):
-    packets = (iv_list, ephid_list, tag_list) = read_packets()  # Read all the packets received
-    print('#EphIDs:', len(packets[1]))
-
-    keys = (public_key_list, sk_list) = read_keys()  # Read all the public keys of infected users received
-    print('#SK:', len(keys[1]))
-
-    for (public_key, sk) in zip(*keys):
-        encryptor = Encryptor(sk)
-        for (iv, ephid, tag) in zip(*packets):
-            ciphertext = encryptor.encrypt(iv=iv)  # Generate the EphIDs corresponding to each SK
-            ephids = ciphertext[IV_SIZE:]
-            blocks = split_sequence(ephids, N)
-            advtag = tag[:-1] + token_bytes(1)  # The tag computed by an adversary
-            # Check if one of the received EphIDs can be generated by SK
-            if ephid not in blocks:
-                continue
-            else:
+    verifiers = {}
+    results = {}
+    for report in reports:
+        if report in results:
+            continue
+        public_key, ephid, tag = report
+        if public_key not in verifiers:
+            verifiers[public_key] = Verifier(PublicSK.construct_public_key(public_key))
+        results[report] = verifiers[public_key].verify(ephid, tag)
+    return results
+
+
+def main(is_adv, workers=1, full=False, screen=False, cached=False):
+    prune_packets()  # Delete the packets received before the retention window
+
+    days = stored_days()  # Find the days some packets have been received in
+    if not days:
+        print('No EphIDs received yet.')
+
+    # Read all the public keys and the SKs of infected users received
+    public_key_list, sk_list, origin_list = read_keys(workers)
+    print('#SK:', len(sk_list))
+
+    # Read what the previous runs have already matched (nothing, if the SKs have been removed or --full is passed)
+    checkpoint = MatchCheckpoint(MATCH_CHECKPOINT_FILE)
+    if full or checkpoint.sks() > len(sk_list):
+        checkpoint.reset()
+    old_sks = checkpoint.sks()
+    print('#New SK:', len(sk_list) - old_sks)
+
+    # The SKs of the previous days are derived reusing the checkpoints of their hash chains stored by the previous runs
+    sk_chains = SKChainTable(SK_CHAIN_TABLE_FILE, size=max(len(sk_list), SK_CHAIN_TABLE_SIZE))
+
+    # The same cache (if any, since it takes up to EPHID_CACHE_MAX_SIZE bytes on disk) and the same worker processes
+    # are used for all the days
+    cache = EphIDCache(EPHID_CACHE_FILE) if cached or screen else None
+    reports = []
+    matched_packets = {}
+    with create_executor(workers, cache) if workers > 1 else nullcontext() as executor:
+        for day in days:
+            # Read the packets received in the day
+            packets = (iv_list, ephid_list, tag_list, slot_list) = read_packets(day)
+            old_packets = checkpoint.packets(day)
+            if old_packets > len(packets[1]):
+                old_packets = 0
+            print(day.strftime(Key.LAST_UPDATE_DATE_FORMAT), '#EphIDs:', len(packets[1]),
+                  '#New EphIDs:', len(packets[1]) - old_packets)
+
+            # The SKs the infected users have used in the day, the ones in the first old_sks positions
+            # having already been matched by the previous runs
+            users, day_sk_list = sks_of_day(day, sk_list, origin_list, sk_chains)
+            day_old_sks = bisect_left(users, old_sks)
+
+            # Find which of the received EphIDs can be generated by the SKs of the infected users in the slots
+            # close to the one they have been received in (only the new SKs and the new EphIDs are matched)
+            matches = match_new_packets(day_sk_list, iv_list, ephid_list, workers, day_old_sks, old_packets,
+                                        slot_list, SLOT_TOLERANCE, cache,
+                                        BLOOM_FALSE_POSITIVE_RATE if screen else None, executor)
+            matched_packets[day] = len(packets[1])
+            for (i, j) in matches:
+                public_key = public_key_list[users[i]]
+                ephid, tag = bytes(ephid_list[j]), bytes(tag_list[j])
+                advtag = tag[:-1] + token_bytes(1)  # The tag computed by an adversary
                 # the tag to send is the received one itself if the user is honest
                 tag_to_send = advtag if is_adv else tag
-                print(ephid.hex())
+                reports.append((public_key, ephid, tag_to_send))
+
+    sk_chains.save()
 
-                retval = verify(public_key, ephid, tag_to_send)  # True if the tag is honest, False otherwise
-                print(retval)
+    results = verify_many(reports)  # True for each honest tag, False otherwise
 
-                data = public_key + ephid + tag_to_send  # Send <pk,ephid,tag> to server
-                send_data_to_server(data)
+    if results:
+        for ((public_key, ephid, tag_to_send), retval) in results.items():
+            print(ephid.hex())
+            print(retval)
+
+        # Send all the <pk,ephid,tag> to server in a single batch
+        send_data_to_server([public_key + ephid + tag_to_send for (public_key, ephid, tag_to_send) in results])
+
+    # The checkpoint is saved only once the reports have been sent, so that no match is lost if sending them fails
+    checkpoint.update(len(sk_list), matched_packets)
+    checkpoint.save()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        # The first argument is a simulation variable
-        # Run python script_receiver.py 1 on the shell if you want to simulate an adversary-like behavior
-        # Run python script_receiver.py 0 on the shell if you want to simulate a honest-user-like behavior
-        main(bool(int(sys.argv[1])))
-    else:
-        raise SystemError('Invalid launch command.')
+    parser = argparse.ArgumentParser(description='Check the recent contacts with infected people.')
+    # The first argument is a simulation variable
+    # Run python script_receiver.py 1 on the shell if you want to simulate an adversary-like behavior
+    # Run python script_receiver.py 0 on the shell if you want to simulate a honest-user-like behavior
+    parser.add_argument('is_adv', type=int, choices=(0, 1), help='1 to simulate an adversary-like behavior')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes the SKs of the infected users are matched by')
+    parser.add_argument('--full', action='store_true',
+                        help='match all the received EphIDs again, not only the ones received since the last run')
+    parser.add_argument('--screen', action='store_true',
+                        help='screen the received EphIDs with Bloom filters of the EphIDs of the infected users, '
+                             'kept from one run to the next in the cache (implies --cache)')
+    parser.add_argument('--cache', action='store_true',
+                        help='cache the EphIDs of the infected users on disk from one run to the next, '
+                             f'up to {EPHID_CACHE_MAX_SIZE // (1024 * 1024)} MB')
+    args = parser.parse_args()
+    main(bool(args.is_adv), args.workers, args.full, args.screen, args.cache)
@@ -12,15 +12,16 @@ from datetime import datetime
 
 from parameters import N, L, SK_SIZE
 from definitions import IV_SIZE, SIGNATURE_SIZE, PACKET_SIZE
-from sender.sen_definitions import CIPHERTEXT_FILE, LAST_CIPHERTEXT_UPDATE_FILE
-from receiver.rec_definitions import (EPHID_AND_SIGNATURE_FILE, RECEIVER_DIR, PUBLIC_KEY_INFECTED_FILE,
-                                      SK_INFECTED_FILE)
+from sender.sen_definitions import (CIPHERTEXT_FILE, LAST_CIPHERTEXT_UPDATE_FILE, SCHEDULE_FILE,
+                                    LAST_SCHEDULE_UPDATE_FILE)
+from receiver.packet_store import store_packet
+from receiver.rec_definitions import PACKETS_DIR, RECEIVER_DIR, PUBLIC_KEY_INFECTED_FILE, SK_INFECTED_FILE
 
 from key_generator import PublicSK, PrivateSK
 from cipher import Encryptor
 from signatures import Signer
 
-from utils import split_sequence, get_current_minutes, append_if_absent
+from utils import split_sequence, get_current_minutes, append_if_absent, write_atomically
 
 
 def generateSK(is_infected):
@@ -112,61 +113,102 @@ def encrypt(sk):
     return ciphertext
 
 
-def getEphID(sk):
-    """Returns the current EphID to broadcast. It changes every L minutes.
-    For example, the first EphID will be broadcasted for the first L minutes of the day;
-    the second EphID will be broadcasted for the second L minutes of the day, and so on.
+def sign_ephids(sk, ephids):
+    """Returns the signatures of many EphIDs.
+    :param sk: a PublicSK object storing the information about the user's SK, containing the private signature key too.
+    :param ephids: a list of the EphIDs to sign
+    :return signatures: a list of the signatures, in the same order as :param ephids"""
+    key = sk.get_private_key()  # The private key imported when the SK has been read
+    signer = Signer(key)
+    signatures = signer.sign_many(ephids)
+    return signatures
+
+
+def update_schedule(sk, ciphertext, is_infected):
+    """Produces the packets to broadcast in each slot of the day, and stores them in the corresponding file.
+    Since the signatures are deterministic, all of them are computed once, when the ciphertext of the day is ready.
+    The packets replace the old ones at once (see write_atomically), and the date of the update is written only
+    afterwards, so that a crash never leaves a partially written or outdated schedule.
     :param sk: a {Public,Private}SK object storing the information about the user's SK,
-        used for deciding where the file containing the EphIDs is supposed to be stored"""
-    with open(os.path.join(sk.directory(), CIPHERTEXT_FILE), "rb") as f:
-        ciphertext = f.read()
-    ephids = ciphertext[IV_SIZE:]
-    ephid_list = split_sequence(ephids, N)
+        used for signing and also for deciding where the file is supposed to be stored
+    :param ciphertext: the bytes sequence representing the current ciphertext (IV + N EphIDs)
+    :param is_infected: a boolean variable; it is True if the user is infected, False otherwise
+    :return schedule: the bytes sequence representing the N packets of the day, one after the other"""
+    iv = ciphertext[:IV_SIZE]  # IV is the first part of the ciphertext
+    ephid_list = split_sequence(ciphertext[IV_SIZE:], N)
     if not len(ephid_list) == N:
         raise ValueError('Not enough EphIDs in ciphertext')
-    minutes_from_midnight = get_current_minutes()
-    ephid = ephid_list[minutes_from_midnight // L]
-    return ephid
 
+    if is_infected:
+        signatures = sign_ephids(sk, ephid_list)  # The signatures are computed as per the used signature scheme
+    else:
+        signatures = [b'\0' * SIGNATURE_SIZE] * N  # The signatures are sequences of SIGNATURE_SIZE empty bytes
+
+    # The packet of each slot is made of <iv, ephid, signature>
+    schedule = b''.join(iv + ephid + signature for (ephid, signature) in zip(ephid_list, signatures))
 
-def sign(sk, ephid):
-    """Returns the signature of an EphID.
-    :param sk: a PublicSK object storing the information about the user's SK, containing the private signature key too.
-    :param ephid: the EphID to sign
-    :return signature: the signature for :param ephid"""
-    key = PublicSK.get_private_key(sk)
-    signer = Signer(key)
-    signature = signer.sign(ephid)
-    return signature
+    write_atomically(os.path.join(sk.directory(), SCHEDULE_FILE), schedule)
+
+    with open(os.path.join(sk.directory(), LAST_SCHEDULE_UPDATE_FILE), "w") as f:
+        f.write(datetime.now().strftime(sk.LAST_UPDATE_DATE_FORMAT))
+
+    return schedule
+
+
+def get_scheduled_packet(directory, date_format):
+    """Returns the current packet to broadcast, reading it from the schedule of the day. It changes every L minutes.
+    For example, the first packet will be broadcasted for the first L minutes of the day;
+    the second packet will be broadcasted for the second L minutes of the day, and so on.
+    The packet is read at its fixed offset in the file, without reading the rest of the schedule.
+    :param directory: the directory the file containing the schedule is supposed to be stored in
+    :param date_format: the format the date of the last update of the schedule is saved with
+    :return packet: the bytes sequence representing the packet to broadcast (IV + EphID + signature),
+        or None if there is no schedule for the current day yet"""
+    try:
+        with open(os.path.join(directory, LAST_SCHEDULE_UPDATE_FILE), "r") as f:
+            if not f.read() == datetime.now().strftime(date_format):
+                return None
+        with open(os.path.join(directory, SCHEDULE_FILE), "rb") as f:
+            f.seek(get_current_minutes() // L * PACKET_SIZE)
+            packet = f.read(PACKET_SIZE)
+    except FileNotFoundError:
+        return None
+
+    if not len(packet) == PACKET_SIZE:
+        return None
+    return packet
 
 
 def main(is_infected):
     """The main script to run.
+    Once the schedule of the day has been produced, broadcasting a packet only reads it from the schedule.
     :param is_infected: a boolean variable; it is True if the user is infected, False otherwise"""
-    sk = generateSK(is_infected)  	# Get the current SK
+    key_class = PublicSK if is_infected else PrivateSK
+    packet = get_scheduled_packet(key_class.DIRECTORY, key_class.LAST_UPDATE_DATE_FORMAT)
 
-    ciphertext = encrypt(sk)	  	# Get the current ciphertext
+    if packet is None:
+        sk = generateSK(is_infected)  	# Get the current SK
 
-    ephid = getEphID(sk)			# Get the current EphID
+        ciphertext = encrypt(sk)	  	# Get the current ciphertext
 
-    if is_infected:
-        signature = sign(sk, ephid)  			# The signature is computed as per the used signature scheme
-    else:
-        signature = b'\0' * SIGNATURE_SIZE		# The signature is computed as a sequence of SIGNATURE_SIZE empty bytes
+        schedule = update_schedule(sk, ciphertext, is_infected)  # Produce the packets of the whole day
+
+        # THIS IS A SIMULATION.
+        # THE PUBLIC KEYS AND THE SK OF INFECTED USERS WILL BE SENT TO OTHER USERS BY THE SERVER
+        # IN REAL-WORLD APPLICATION
+        if is_infected:
+            # The public key is sent to the receiver (in the simulation, it is saved in the proper file)
+            sk.export_public_key(os.path.join(RECEIVER_DIR, PUBLIC_KEY_INFECTED_FILE))
+            # The receiver computes the SK from the public key (in the simulation, it is saved in the proper file)
+            append_if_absent(sk.get(), SK_SIZE, os.path.join(RECEIVER_DIR, SK_INFECTED_FILE))
+
+        # The packet of the current slot is taken from the schedule just produced, without reading it again
+        slot = get_current_minutes() // L
+        packet = schedule[slot * PACKET_SIZE:(slot + 1) * PACKET_SIZE]
 
     # THIS IS A SIMULATION. IV + EPHID + SIGNATURE WILL BE SENT IN BROADCAST VIA BLE IN REAL-WORLD APPLICATION
-    iv = ciphertext[:IV_SIZE]			# IV is the first part of the ciphertext
-    packet = iv + ephid + signature		# The packet is made of <iv, ephid, signature>
     # The packet is sent to the receiver (in the simulation, it is saved in the proper file)
-    append_if_absent(packet, PACKET_SIZE, os.path.join(RECEIVER_DIR, EPHID_AND_SIGNATURE_FILE))
-
-    # THIS IS A SIMULATION.
-    # THE PUBLIC KEYS AND THE SK OF INFECTED USERS WILL BE SENT TO OTHER USERS BY THE SERVER IN REAL-WORLD APPLICATION
-    if is_infected:
-        # The public key is sent to the receiver (in the simulation, it is saved in the proper file)
-        sk.export_public_key(os.path.join(RECEIVER_DIR, PUBLIC_KEY_INFECTED_FILE))
-        # The receiver computes the SK from the public key (in the simulation, it is saved in the proper file)
-        append_if_absent(sk.get(), SK_SIZE, os.path.join(RECEIVER_DIR, SK_INFECTED_FILE))
+    store_packet(packet, os.path.join(RECEIVER_DIR, PACKETS_DIR))
 
 
 if __name__ == '__main__':
@@ -15,3 +15,9 @@ CIPHERTEXT_FILE = "ciphertext.pem"
 
 # File the date of the last update of the ciphertext is stored in
 LAST_CIPHERTEXT_UPDATE_FILE = "last_ciphertext_update.txt"
+
+# File the packets to broadcast in each slot of the day (IV + EphID + signature, N packets) are stored in
+SCHEDULE_FILE = "schedule.pem"
+
+# File the date of the last update of the packets to broadcast is stored in
+LAST_SCHEDULE_UPDATE_FILE = "last_schedule_update.txt"
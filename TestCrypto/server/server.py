@@ -4,39 +4,59 @@ import sys
 sys.path.append('../')
 
 
+import argparse
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
 import socket
 import ssl
+import threading
+import time
 
 from definitions import EPHID_SIZE, SIGNATURE_SIZE
 from key_generator import PUBLIC_KEY_SIZE, PublicSK
+from protocol import (HEADER_SIZE, WELCOME, REPORTS, ERROR, BUSY, INVALID_SIGNATURE, VALID_SIGNATURE, INVALID_REPORT,
+                      encode_frame, decode_header, decode_reports, encode_statuses, read_frame)
 from signatures import Verifier
 
 
-MESSAGE_SIZE = PUBLIC_KEY_SIZE + EPHID_SIZE + SIGNATURE_SIZE
-
 SERVER_BACKEND_CERT_PATH = "../intermediateCA/certs/intermediateCA-rootCA-chain.cert.pem"
 SERVER_BACKEND_KEY_PATH = "../intermediateCA/private/intermediateCAkey.pem"
 
 HOST = '127.0.0.1'
 PORT = 8443
 
+# Maximum number of pending connections
+BACKLOG = 128
 
-def verify(sk, ephid, tag):
-    """
-    This function verifies that the signature tag is valid and corresponds to the signature of the EphID generated using
-    the private key of an infected person. The verification process needs the public key.
-    Since the signature algorithm uses elliptic curves, we only need two
-    paramters, x and y, to reconstruct the public key of the infected person.
-    The type of curve is defined by the protocol.
-    :param sk: public key used to verify
-    :param ephid: the original ephid transmitted by the non infected person
-    :param tag: the signature of the ephid to be verified
-    :return True if the signature is valid or not
-    """
-    pk = PublicSK.construct_public_key(sk)
-    verifier = Verifier(pk)
-    signature_valid = verifier.verify(ephid, tag)
-    return signature_valid
+# Maximum number of seconds the server waits for a frame of a client
+READ_TIMEOUT = 10
+
+# Maximum number of seconds the server spends rejecting a client when it is too busy
+REJECT_TIMEOUT = 1
+
+# Maximum number of clients waiting to be told the server is too busy: the following ones are disconnected at once
+REJECT_QUEUE_SIZE = 16
+
+# Number of seconds the supervisor waits before restarting a crashed worker process
+RESTART_DELAY = 1
+
+# Maximum number of seconds the supervisor waits before restarting a worker process
+# (the delay doubles every time the process exits right after being started)
+MAX_RESTART_DELAY = 60
+
+# Number of seconds a worker process has to run for, for its exit not to count as an immediate one
+IMMEDIATE_EXIT_TIME = 10
+
+# Number of consecutive immediate exits after which a worker process is not restarted anymore
+MAX_IMMEDIATE_EXITS = 5
+
+WELCOME_MESSAGE = b"Welcome to the serverDP3T! Who has violated the quarantine?"
+INVALID_MESSAGE = b'The message is not valid.'
+BUSY_MESSAGE = b'The server is busy, try again later.'
 
 
 def split_message(data):
@@ -51,46 +71,316 @@ def split_message(data):
     return sk, ephid, tag
 
 
-def main():
-    # opening a socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(10)
+def create_ssl_context():
+    """
+    Creates the SSL context of the server, loading its certificate chain and its private key.
+    The context is created only once, and shared by all the connections.
+    :return context: the SSL context of the server
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=SERVER_BACKEND_CERT_PATH, keyfile=SERVER_BACKEND_KEY_PATH)
+    return context
 
-    # accept the connection from the client
-    client, fromaddr = server_socket.accept()
-    secure_sock = ssl.wrap_socket(client, server_side=True, certfile=SERVER_BACKEND_CERT_PATH,
-                                  keyfile=SERVER_BACKEND_KEY_PATH)
+
+def process_reports(payload):
+    """
+    Checks the reports received from a client in a single frame.
+    The reports are grouped by public key: the public key of each infected person is reconstructed only once,
+    and all the signatures made with it are verified by the same verifier.
+    :param payload: the payload of the frame received from the client
+    :raises ValueError: if the payload does not contain proper reports
+    :return statuses: a list of the statuses of the reports, in the same order they have been received
+    """
+    # splitting each report in different part
+    reports = [split_message(report) for report in decode_reports(payload)]
+
+    positions = {}
+    for k, (sk, ephid, tag) in enumerate(reports):
+        positions.setdefault(sk, []).append(k)
+
+    statuses = [INVALID_REPORT] * len(reports)
+    for sk, sk_positions in positions.items():
+        try:
+            verifier = Verifier(PublicSK.construct_public_key(sk))
+        except ValueError:
+            # the public key is not a point of the curve
+            continue
+
+        results = verifier.verify_many([reports[k][1:] for k in sk_positions])
+        for k, signature_valid in zip(sk_positions, results):
+            if signature_valid:
+                # here the autority will be notified of the violation of the quatantine by the person who has
+                # that public key.
+                statuses[k] = VALID_SIGNATURE
+            else:
+                # someone is trying to forge the signature. ban him.
+                statuses[k] = INVALID_SIGNATURE
+
+    return statuses
+
+
+def report_cache_info(*args):
+    """
+    Prints how many public keys have been constructed from scratch, and how many have been found in the cache.
+    It is called when the server shuts down, and whenever the process receives SIGUSR1 (where it is available).
+    :param args: the signal number and the current stack frame, when called as a signal handler
+    """
+    print(f'Process {os.getpid()}: {PublicSK.public_key_cache_info()}')
+
+
+async def handle_client(reader, writer):
+    """
+    Serves a single client, once the TLS handshake has been performed.
+    The client can send many frames of reports on the same connection, until it closes it.
+    The signatures are verified in a separate thread, not to block the other clients.
+    :param reader: the StreamReader object to read the data from the client
+    :param writer: the StreamWriter object to write the data to the client
+    """
+    # prints the name of the connected peer and the cipher suite.
+    print(repr(writer.get_extra_info('peername')))
+    print(writer.get_extra_info('cipher'))
+
+    try:
+        writer.write(encode_frame(WELCOME, WELCOME_MESSAGE))
+        await writer.drain()
+
+        while True:
+            # reading the frames from the client, until it closes the connection
+            try:
+                header = await asyncio.wait_for(reader.readexactly(HEADER_SIZE), READ_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                break
+
+            try:
+                frame_type, size = decode_header(header)
+                if not frame_type == REPORTS:
+                    raise ValueError(f'Unexpected frame type {frame_type}')
+                payload = await asyncio.wait_for(reader.readexactly(size), READ_TIMEOUT)
+                statuses = await asyncio.get_running_loop().run_in_executor(None, process_reports, payload)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                writer.write(encode_frame(ERROR, INVALID_MESSAGE))
+                await writer.drain()
+                break
+
+            writer.write(encode_statuses(statuses))
+            await writer.drain()
+    except (ConnectionError, ssl.SSLError) as e:
+        print(str(e))
+    finally:
+        writer.close()
+
+
+async def main(reuse_port=False):
+    # opening a single listening socket, serving all the clients concurrently
+    # (if reuse_port is True, other processes can listen on the same port, and the kernel balances the connections)
+    server = await asyncio.start_server(handle_client, HOST, PORT, ssl=create_ssl_context(), backlog=BACKLOG,
+                                        reuse_port=reuse_port)
+
+    async with server:
+        await server.serve_forever()
+
+
+def serve_client(client, context):
+    """
+    Serves a single client in a worker thread, performing the TLS handshake first.
+    The client can send many frames of reports on the same connection, until it closes it.
+    :param client: the socket connected to the client
+    :param context: the SSL context of the server
+    """
+    try:
+        client.settimeout(READ_TIMEOUT)
+        secure_sock = context.wrap_socket(client, server_side=True)
+    except OSError as e:
+        print(str(e))
+        client.close()
+        return
 
     # prints the name of the connected peer and the cipher suite.
     print(repr(secure_sock.getpeername()))
     print(secure_sock.cipher())
 
     try:
-        secure_sock.write(b"Welcome to the serverDP3T! Who has violated the quarantine?")
-        # reading the data from the client and checking that it is correct
-        data = secure_sock.read(MESSAGE_SIZE)
-        if len(data) != MESSAGE_SIZE:
-            raise IndexError
-
-        # splitting the message in different part
-        sk, ephid, tag = split_message(data)
-
-        if verify(sk, ephid, tag):
-            secure_sock.write(b'Thanks for your help :) the subject has violated the quarantine!')
-        # here the autority will be notified of the violation of the quatantine by the person who has
-        # that public key.
-        else:
-            secure_sock.write(b'Thanks for your help :( but you are trying to scam the system...')
-    # someone is trying to forge the signature. ban him.
-    except IndexError as e:
-        secure_sock.write(b'The message is not valid.')
+        secure_sock.sendall(encode_frame(WELCOME, WELCOME_MESSAGE))
+
+        while True:
+            # reading the frames from the client, until it closes the connection
+            try:
+                frame_type, payload = read_frame(secure_sock)
+            except ValueError:
+                secure_sock.sendall(encode_frame(ERROR, INVALID_MESSAGE))
+                break
+            except OSError:
+                break
+
+            try:
+                if not frame_type == REPORTS:
+                    raise ValueError(f'Unexpected frame type {frame_type}')
+                statuses = process_reports(payload)
+            except ValueError:
+                secure_sock.sendall(encode_frame(ERROR, INVALID_MESSAGE))
+                break
+
+            secure_sock.sendall(encode_statuses(statuses))
+    except OSError as e:
+        print(str(e))
     finally:
         secure_sock.close()
-        server_socket.close()
 
 
-if __name__ == '__main__':
+def reject_client(client, context):
+    """
+    Tells a client that the server is too busy to serve it, and closes the connection.
+    :param client: the socket connected to the client
+    :param context: the SSL context of the server
+    """
+    try:
+        client.settimeout(REJECT_TIMEOUT)
+        with context.wrap_socket(client, server_side=True) as secure_sock:
+            secure_sock.sendall(encode_frame(BUSY, BUSY_MESSAGE))
+    except OSError as e:
+        print(str(e))
+    finally:
+        client.close()
+
+
+def worker(clients, context):
+    """
+    Serves the clients waiting in the queue, one at a time, forever.
+    :param clients: the queue of the sockets connected to the clients
+    :param context: the SSL context of the server
+    """
+    while True:
+        serve_client(clients.get(), context)
+
+
+def rejecter(rejected, context):
+    """
+    Rejects the clients waiting in the queue, one at a time, forever.
+    :param rejected: the queue of the sockets connected to the clients to reject
+    :param context: the SSL context of the server
+    """
     while True:
-        main()
+        reject_client(rejected.get(), context)
+
+
+def main_threads(workers, queue_size, reuse_port=False):
+    """
+    Serves the clients with a pool of worker threads.
+    A single thread accepts the connections and puts them in a bounded queue the workers take them from:
+    if the queue is full, the client is handed to a separate thread, which rejects it with a busy response,
+    so that the TLS handshake of a rejected client never delays accepting the others.
+    If the clients waiting to be rejected are too many as well, the connection is closed at once.
+    :param workers: the number of worker threads
+    :param queue_size: the maximum number of accepted clients waiting for a worker
+    :param reuse_port: (Optional) True if other processes can listen on the same port, False otherwise
+    """
+    context = create_ssl_context()
+    clients = queue.Queue(maxsize=queue_size)
+    rejected = queue.Queue(maxsize=REJECT_QUEUE_SIZE)
+
+    for _ in range(workers):
+        threading.Thread(target=worker, args=(clients, context), daemon=True).start()
+    threading.Thread(target=rejecter, args=(rejected, context), daemon=True).start()
+
+    # opening a single listening socket, serving all the clients concurrently
+    with socket.create_server((HOST, PORT), backlog=BACKLOG, reuse_port=reuse_port) as server_socket:
+        while True:
+            client, fromaddr = server_socket.accept()
+            try:
+                clients.put_nowait(client)
+            except queue.Full:
+                try:
+                    rejected.put_nowait(client)
+                except queue.Full:
+                    client.close()
+
+
+def serve(mode, workers, queue_size, reuse_port=False):
+    """
+    Runs the server in the given mode.
+    :param mode: 'asyncio' to serve the clients with an event loop, 'threads' to serve them with a pool of threads
+    :param workers: the number of worker threads (threads mode)
+    :param queue_size: the maximum number of accepted clients waiting for a worker (threads mode)
+    :param reuse_port: (Optional) True if other processes can listen on the same port, False otherwise
+    """
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, report_cache_info)
+
+    try:
+        if mode == 'threads':
+            main_threads(workers, queue_size, reuse_port)
+        else:
+            asyncio.run(main(reuse_port))
+    finally:
+        report_cache_info()
+
+
+def supervise(processes, mode, workers, queue_size):
+    """
+    Runs many server processes, each one listening on the same port with its own SSL context, so that the kernel
+    balances the connections among them (and the signatures are verified on different cores).
+    Every worker process that exits is restarted after RESTART_DELAY seconds. If it keeps exiting right after being
+    started (e.g. because the port is already in use), the delay doubles every time, up to MAX_RESTART_DELAY,
+    and after MAX_IMMEDIATE_EXITS consecutive immediate exits it is not restarted anymore.
+    The supervisor exits once no worker process is left.
+    :param processes: the number of worker processes
+    :param mode: the mode each worker process serves the clients in (see serve)
+    :param workers: the number of worker threads of each worker process (threads mode)
+    :param queue_size: the maximum number of accepted clients waiting for a worker thread (threads mode)
+    """
+    def start():
+        process = multiprocessing.Process(target=serve, args=(mode, workers, queue_size, True), daemon=True)
+        process.start()
+        return process, time.monotonic()
+
+    # the running worker processes with the time they have been started at, the consecutive immediate exits
+    # and the time the exited ones are restarted at, for each of the worker processes
+    running = {i: start() for i in range(processes)}
+    failures = dict.fromkeys(running, 0)
+    restarts = {}
+
+    while running or restarts:
+        timeout = max(min(restarts.values()) - time.monotonic(), 0) if restarts else None
+        multiprocessing.connection.wait([process.sentinel for (process, started) in running.values()], timeout)
+
+        now = time.monotonic()
+        for i, (process, started) in list(running.items()):
+            if process.is_alive():
+                continue
+            del running[i]
+
+            failures[i] = failures[i] + 1 if now - started < IMMEDIATE_EXIT_TIME else 0
+            if failures[i] >= MAX_IMMEDIATE_EXITS:
+                print(f'Worker process {process.pid} exited with code {process.exitcode} right after being started '
+                      f'{failures[i]} times in a row, not restarting it')
+                continue
+
+            delay = min(RESTART_DELAY * 2 ** max(failures[i] - 1, 0), MAX_RESTART_DELAY)
+            print(f'Worker process {process.pid} exited with code {process.exitcode}, restarting it in {delay} s')
+            restarts[i] = now + delay
+
+        for i, restart in list(restarts.items()):
+            if restart <= now:
+                del restarts[i]
+                running[i] = start()
+
+    sys.exit('No worker process left, exiting')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the reports of quarantine violations.')
+    parser.add_argument('--mode', choices=('asyncio', 'threads'), default='asyncio',
+                        help='serve the clients with an asyncio event loop or with a pool of threads')
+    parser.add_argument('--workers', type=int, default=8, help='number of worker threads (threads mode)')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='number of clients waiting for a worker before new ones are rejected (threads mode)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of server processes sharing the port with SO_REUSEPORT')
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            parser.error('--processes is not supported on this platform (SO_REUSEPORT is not available)')
+        supervise(args.processes, args.mode, args.workers, args.queue_size)
+    else:
+        serve(args.mode, args.workers, args.queue_size)
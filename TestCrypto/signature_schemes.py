@@ -0,0 +1,174 @@
+"""
+This module contains the signature schemes the packets can be signed with, and the registry to select one by name.
+Each scheme defines the curve its key pairs are generated on, the size of its public keys and signatures,
+and how messages are signed and verified.
+Signing and verifying go through a context prepared once for each key, which can be reused for any number of messages.
+This module only depends on the cryptographic library, so that the sizes of the protocol can be derived from it.
+"""
+
+
+from abc import ABC
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC
+from Crypto.Signature import DSS, eddsa
+
+
+class SignatureScheme(ABC):
+    """An Abstract Base Class representing a signature scheme on elliptic curves"""
+
+    # Name the scheme is registered with
+    NAME = None
+
+    # Curve the key pairs are generated on
+    CURVE = None
+
+    # Size in bytes of the public keys, as returned by public_key_bytes
+    PUBLIC_KEY_SIZE = None
+
+    # Size in bytes of the coordinates of the points of the curve
+    COORDINATE_SIZE = None
+
+    # Size in bytes of the signatures
+    SIGNATURE_SIZE = None
+
+    @classmethod
+    def public_key_bytes(cls, public_key):
+        """:returns the bytes sequence of PUBLIC_KEY_SIZE bytes representing :param public_key, an EccKey object"""
+        pass
+
+    @classmethod
+    def construct_public_key(cls, data):
+        """Constructs a public key starting from the bytes sequence representing it.
+        :param data: the bytes sequence representing the public key, as returned by public_key_bytes
+        :raises ValueError if :param data does not represent a point of the curve
+        :returns an EccKey object containing the public key"""
+        pass
+
+    @classmethod
+    def new_context(cls, key):
+        """Prepares the signing or verifying of many messages with a key.
+        :param key: the EccKey object holding the private signature key or the public one
+        :returns the context to pass to sign or verify"""
+        pass
+
+    @classmethod
+    def sign(cls, context, msg):
+        """Produces the signature for a message.
+        :param context: the context of the private signature key, as returned by new_context
+        :param msg: the message to sign
+        :return signature: the signature for :param msg, of SIGNATURE_SIZE bytes"""
+        pass
+
+    @classmethod
+    def verify(cls, context, msg, tag):
+        """Checks if a signature for a message is valid.
+        :param context: the context of the public signature key, as returned by new_context
+        :param msg: the signed message
+        :param tag: the signature to verify
+        :returns True if the signature is valid, False otherwise"""
+        pass
+
+
+class ECDSAP256(SignatureScheme):
+    """ECDSA on the NIST P-256 curve, with deterministic nonces (https://tools.ietf.org/html/rfc6979).
+    The public key is the concatenation of the coordinates x and y of its point,
+    and the message is hashed with SHA-256 before being signed."""
+
+    NAME = 'ecdsa-p256'
+
+    CURVE = 'P-256'
+
+    COORDINATE_SIZE = 32
+
+    PUBLIC_KEY_SIZE = 2 * COORDINATE_SIZE
+
+    SIGNATURE_SIZE = 64
+
+    # Standard used to sign and verify messages
+    STANDARD = 'deterministic-rfc6979'
+
+    @classmethod
+    def public_key_bytes(cls, public_key):
+        point = public_key.pointQ
+        return int(point.x).to_bytes(cls.COORDINATE_SIZE, 'big') + int(point.y).to_bytes(cls.COORDINATE_SIZE, 'big')
+
+    @classmethod
+    def construct_public_key(cls, data):
+        x = int.from_bytes(data[:cls.COORDINATE_SIZE], 'big')
+        y = int.from_bytes(data[cls.COORDINATE_SIZE:], 'big')
+        return ECC.construct(curve=cls.CURVE, point_x=x, point_y=y)
+
+    @classmethod
+    def new_context(cls, key):
+        return DSS.new(key, cls.STANDARD)
+
+    @classmethod
+    def sign(cls, context, msg):
+        return context.sign(SHA256.new(msg))
+
+    @classmethod
+    def verify(cls, context, msg, tag):
+        try:
+            context.verify(SHA256.new(msg), tag)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+class Ed25519(SignatureScheme):
+    """EdDSA on Curve25519 (https://tools.ietf.org/html/rfc8032), whose signatures are deterministic and
+    much cheaper to verify than ECDSA ones.
+    The public key is the standard 32 bytes encoding of its point, and the message is signed as it is."""
+
+    NAME = 'ed25519'
+
+    CURVE = 'Ed25519'
+
+    COORDINATE_SIZE = 32
+
+    PUBLIC_KEY_SIZE = 32
+
+    SIGNATURE_SIZE = 64
+
+    # Standard used to sign and verify messages
+    STANDARD = 'rfc8032'
+
+    @classmethod
+    def public_key_bytes(cls, public_key):
+        return public_key.public_key().export_key(format='raw')
+
+    @classmethod
+    def construct_public_key(cls, data):
+        return eddsa.import_public_key(data)
+
+    @classmethod
+    def new_context(cls, key):
+        return eddsa.new(key, cls.STANDARD)
+
+    @classmethod
+    def sign(cls, context, msg):
+        return context.sign(msg)
+
+    @classmethod
+    def verify(cls, context, msg, tag):
+        try:
+            context.verify(msg, tag)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+# The supported signature schemes, by name
+SIGNATURE_SCHEMES = {scheme.NAME: scheme for scheme in (ECDSAP256, Ed25519)}
+
+
+def get_signature_scheme(name):
+    """Returns the signature scheme registered with a name.
+    :param name: the name of the scheme (see SIGNATURE_SCHEMES)
+    :raises ValueError if no scheme is registered with :param name
+    :returns the SignatureScheme subclass implementing the scheme"""
+    try:
+        return SIGNATURE_SCHEMES[name]
+    except KeyError:
+        raise ValueError(f'Signature scheme {name} not supported')
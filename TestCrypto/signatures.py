@@ -1,58 +1,66 @@
 """
 This module contains the methods and classes to produce signatures of messages.
-It follows the Digital Signature Standard (DSS) to sign messages.
-It uses the Elliptic Curve Encyption (ECC) to produce key pairs valid for signing messages.
+It uses the signature scheme selected in the definitions (see signature_schemes),
+e.g. the Digital Signature Standard (DSS) with Elliptic Curve Encyption (ECC) key pairs.
 https://nvlpubs.nist.gov/nistpubs/FIPS/NIST.FIPS.186-4.pdf
 """
 
 
-from Crypto.Hash import SHA256
-from Crypto.Signature import DSS
-
-from definitions import STANDARD
+from definitions import SIGNATURE_SCHEME
 
 
 class Signer:
-    """Class containing parameters and methods to produce the signatures of messages
-    :param key: the EccKey object holding the private signature key"""
+    """Class containing parameters and methods to produce the signatures of messages.
+    The signing context of the key is prepared once, and reused for all the signed messages.
+    :param key: the EccKey object holding the private signature key
+    :param context: the signing context of :param key (see signature_schemes.SignatureScheme.new_context)"""
 
-    __slots__ = ['__key']
+    __slots__ = ['__key', '__context']
 
     def __init__(self, key):
         """Class constructor
         :param key: the EccKey object holding the private signature key"""
         self.__key = key
+        self.__context = SIGNATURE_SCHEME.new_context(key)
 
     def sign(self, msg):
         """Produces the signature for a message.
         :param msg: the message to sign
         :return signature: the signature for :param msg"""
-        h = SHA256.new(msg)
-        signer = DSS.new(self.__key, STANDARD)
-        signature = signer.sign(h)
+        signature = SIGNATURE_SCHEME.sign(self.__context, msg)
         return signature
 
+    def sign_many(self, msgs):
+        """Produces the signatures for many messages.
+        :param msgs: a list of the messages to sign
+        :return signatures: a list of the signatures, in the same order as :param msgs"""
+        return [SIGNATURE_SCHEME.sign(self.__context, msg) for msg in msgs]
+
 
 class Verifier:
-    """Class containing parameters and methods to verify the signatures of messages
-    :param key: the EccKey object holding the public signature key"""
+    """Class containing parameters and methods to verify the signatures of messages.
+    The verifying context of the key is prepared once, and reused for all the verified signatures.
+    :param key: the EccKey object holding the public signature key
+    :param context: the verifying context of :param key (see signature_schemes.SignatureScheme.new_context)"""
 
-    __slots__ = ['__key']
+    __slots__ = ['__key', '__context']
 
     def __init__(self, key):
         """Class constructor
         :param key: the EccKey object holding the public signature key"""
         self.__key = key
+        self.__context = SIGNATURE_SCHEME.new_context(key)
 
     def verify(self, msg, tag):
         """Produces if a signature for a message is valid.
         :param msg: the signed message
         :param tag: the signature to verify
         :returns True if the signature is valid, False otherwise"""
-        h = SHA256.new(msg)
-        verifier = DSS.new(self.__key, STANDARD)
-        try:
-            verifier.verify(h, tag)
-            return True
-        except (ValueError, TypeError):
-            return False
+        return SIGNATURE_SCHEME.verify(self.__context, msg, tag)
+
+    def verify_many(self, pairs):
+        """Checks if many signatures are valid.
+        :param pairs: a list of couples (message, signature) to verify
+        :return results: a list containing True for each valid signature and False otherwise,
+            in the same order as :param pairs"""
+        return [SIGNATURE_SCHEME.verify(self.__context, msg, tag) for (msg, tag) in pairs]
@@ -2,28 +2,133 @@
 This module contains useful operations, not strictly related to cybersecurity contexts.
 """
 
+import mmap
+import os
 from datetime import datetime
 
+import numpy as np
+
+
+class AppendOnlyStore:
+    """Class representing a file made of records of the same size, which are only appended at the end of it.
+    The records in the file are indexed in memory the first time they are needed, so that checking if a record
+    is already present takes constant time; afterwards, only the records appended by other processes are read.
+    :param file: the file the records are stored in
+    :param size: the size in bytes of each record
+    :param index: the set of the records in the file
+    :param offset: the size in bytes of the part of the file which has been indexed"""
+
+    __slots__ = ['__file', '__size', '__index', '__offset']
+
+    def __init__(self, file, size):
+        """Class constructor
+        :param file: the file the records are stored in
+        :param size: the size in bytes of each record"""
+        self.__file = file
+        self.__size = size
+        self.__index = set()
+        self.__offset = 0
+
+    def _refresh(self):
+        """Indexes the records appended to the file since the last time it has been read.
+        If the file has been truncated or deleted in the meantime, it is indexed again from scratch."""
+        try:
+            file_size = os.path.getsize(self.__file)
+        except FileNotFoundError:
+            file_size = 0
+
+        if file_size < self.__offset:
+            self.__index = set()
+            self.__offset = 0
+
+        if file_size - self.__offset < self.__size:
+            return
+
+        with open(self.__file, "rb") as f:
+            f.seek(self.__offset)
+            content = f.read(file_size - self.__offset)
+
+        # A record still being written by another process will be indexed the next time
+        content = content[:len(content) - len(content) % self.__size]
+        self.__index.update(split_in_chunks(content, self.__size))
+        self.__offset += len(content)
+
+    def __contains__(self, data):
+        """:returns True if :param data is one of the records of the file, False otherwise"""
+        self._refresh()
+        return data in self.__index
+
+    def append_if_absent(self, data):
+        """Appends a record at the end of the file if it is not already present in it.
+        If the file doesn't exist, a new one is created.
+        :param data: the bytes sequence representing the record to append
+        :returns True if the record has been appended, False if it was already present"""
+        if data in self:
+            return False
+
+        with open(self.__file, "ab") as f:
+            f.write(data)
+
+        self.__index.add(data)
+        self.__offset += self.__size
+        return True
+
+
+# The stores opened by the process, so that each file is indexed only once
+_stores = {}
+
+
+def get_store(file, size):
+    """Returns the AppendOnlyStore object of a file, creating it the first time it is requested.
+    :param file: the file the records are stored in
+    :param size: the size in bytes of each record
+    :returns the AppendOnlyStore object of :param file"""
+    key = (os.path.abspath(file), size)
+    if key not in _stores:
+        _stores[key] = AppendOnlyStore(file, size)
+    return _stores[key]
+
 
 def append_if_absent(data, size, file):
     """Appends data at the end of file if it is not already present in it.
     If the file doesn't exist, a new one is created.
+    The content of the file is indexed only once per process (see AppendOnlyStore).
     :param data: the bytes sequence to append to the file
     :param size: the length of data
     :param file: the file to write the data in
     """
-    try:
-        with open(file, "rb") as f:
-            content = f.read()
-    except FileNotFoundError:
-        with open(file, "wb+") as f:
-            f.write(data)
-        return
+    get_store(file, size).append_if_absent(data)
 
-    with open(file, "ab") as f:
-        c = split_in_chunks(content, size)
-        if data not in c:
-            f.write(data)
+
+def write_atomically(path, data, mode="wb"):
+    """Writes data to a file, replacing its content.
+    The data is written to a temporary file next to it first, named after the process, which then replaces the file,
+    so that a crash never leaves it partially written.
+    :param path: the file to write
+    :param data: the bytes sequence (or string, in text mode) to write
+    :param mode: (Optional) the mode the file is opened in, "wb" (binary, the default) or "w" (text)"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def map_records(file, size):
+    """Memory maps a file made of records of the same size, without reading it.
+    :param file: the file to map
+    :param size: the size in bytes of each record
+    :raises FileNotFoundError if the file doesn't exist
+    :raises ValueError if the size of the file is not a multiple of size
+    :returns a read-only NumPy array of bytes of shape (number of records, size), backed by the mapped file"""
+    with open(file, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if not file_size % size == 0:
+            raise ValueError(f'{file_size} is not a multiple of {size}')
+        if file_size == 0:
+            return np.empty((0, size), dtype=np.uint8)
+        mapping = mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_READ)
+
+    return np.frombuffer(mapping, dtype=np.uint8).reshape(-1, size)
 
 
 def split_sequence(a, n):